@@ -1,9 +1,25 @@
 #!/usr/bin/env python3
-import fontforge
 import os
 import sys
-import subprocess
 import glob
+import fnmatch
+import itertools
+import hashlib
+import json
+import struct
+import math
+import re
+import zlib
+import io
+import threading
+import types
+import contextlib
+import collections
+import filecmp
+import shutil
+import importlib.util
+import argparse
+import time
 
 # Сопоставление букв и SVG файлов
 icon_mapping = {
@@ -38,247 +54,1749 @@ icon_mapping = {
     'z': 'file-zip.svg',
 }
 
-def find_woff_converter():
+# Группы иконок для раздельной загрузки (--chunks): по WOFF2 на группу.
+# Указываются имена SVG или шаблоны; иконки вне групп попадают в группу other
+icon_groups = {
+    'social': ['max.svg', 'vk.svg', 'telegram.svg', 'ok.svg', 'rutube.svg', 'youtube.svg', 'instagram.svg',
+               'facebook.svg'],
+    'ui': ['find.svg', 'link.svg', 'map.svg', 'mail.svg', 'close.svg', 'phone-fax.svg', 'phone.svg', 'people.svg',
+           'play.svg', 'rub.svg'],
+    'arrows': ['arrow-*.svg'],
+    'files': ['file*.svg'],
+}
+
+# Каталог кэша сборки (обработанные глифы и состояние последней сборки)
+CACHE_DIR = ".proto_cache"
+# Версия формата кэша: при изменении обработки глифов увеличиваем
+CACHE_VERSION = 2
+
+# Имена файлов шрифта: постоянные (ProTo.woff2) или с хэшем содержимого (--hashed-names)
+FILE_NAMING = {'hashed': False}
+HASH_LENGTH = 10
+
+# Параметры обработки глифов, влияющие на результат (входят в ключ кэша)
+GLYPH_SETTINGS = {
+    'em': 1000,
+    'ascent': 750,
+    'descent': 250,
+    'simplify': True,
+    'round': True,
+    # Допустимая погрешность упрощения (None — по умолчанию fontforge)
+    'simplify_error': None,
+    # Удалять пересечения контуров
+    'remove_overlap': False,
+    # Объединять отрезки, лежащие на одной прямой
+    'merge_lines': False,
+    # Удалять лишние (одиночные) точки
+    'remove_singletons': False,
+    # Переводить контуры в квадратичные кривые (как в TTF)
+    'quadratic': False,
+    # Шаг сетки округления координат в единицах em (1 — целые числа)
+    'quantize': 1,
+    # Предварительно нормализовать SVG (трансформации, фигуры, масштаб em)
+    'normalize_svg': False,
+    # Хранить одинаковые глифы и общие части контуров как составные ссылки
+    'dedupe': False,
+    # Допуск совпадения контуров при дедупликации в единицах em (0 — только точные совпадения)
+    'dedupe_tolerance': 0,
+    # Импортировать все SVG, затем упрощать и округлять контуры одной операцией над выделением шрифта
+    'batch_ops': False,
+}
+# Параметры уровня шрифта: не влияют на обработку отдельного глифа и не входят в ключ его кэша.
+# batch_ops в ключ входит: контуры, обработанные пакетно и по одному, в кэше не смешиваются
+FONT_SETTINGS = ('dedupe', 'dedupe_tolerance')
+
+# Встроенные (без внешних утилит) кодировщики WOFF/WOFF2
+PYTHON_WOFF_ZOPFLI = 'python-zopfli'
+PYTHON_WOFF_ZLIB = 'python-zlib'
+PYTHON_WOFF2 = 'python-brotli'
+
+# fontTools берет brotli из атрибута модуля: подмена должна быть последовательной
+BROTLI_PATCH_LOCK = threading.Lock()
+
+# Различные возможные имена утилит и их возможности
+WOFF_UTILS = {
+    'sfnt2woff-zopfli': ['woff', 'zopfli'],
+    'sfnt2woff': ['woff', 'zlib'],
+    'woff2sfnt': ['woff'],
+    'woff-utils': ['woff'],
+}
+WOFF2_UTILS = {
+    'woff2_compress': ['woff2', 'brotli'],
+    'woff2': ['woff2'],
+    'google-woff2': ['woff2'],
+}
+# Python-модули, от которых зависят fontforge и встроенные кодировщики
+TOOLCHAIN_MODULES = ['fontforge', 'fontTools', 'brotli', 'zopfli']
+
+# Вывод: обычный, тихий (--quiet), журнал JSON Lines (--log-json) и трасса
+# в формате Chrome (--trace). Сообщения с ⚠ и ❌ печатаются всегда.
+OUTPUT = {'quiet': False, 'verbose': False, 'jsonl': None, 'trace': None}
+OUTPUT_LOCK = threading.Lock()
+# Вывод, отключенный в отдельном потоке (сборки сервиса и библиотечные вызовы)
+OUTPUT_LOCAL = threading.local()
+# Больше стольких глифов построчно не печатаем (кроме --verbose)
+GLYPH_LOG_LIMIT = 100
+
+def configure_output(quiet=False, verbose=False, log_json=None, trace=False):
+    """Настраивает вывод сообщений и запись событий"""
+    OUTPUT['quiet'] = quiet
+    OUTPUT['verbose'] = verbose
+    OUTPUT['jsonl'] = open(log_json, 'w', encoding='utf-8') if log_json else None
+    OUTPUT['trace'] = [] if trace else None
+
+def tracing():
+    """Записываются ли события (журнал или трасса)"""
+    return OUTPUT['jsonl'] is not None or OUTPUT['trace'] is not None
+
+def emit(event):
+    """Записывает событие в журнал JSON Lines и, если это интервал, в трассу"""
+    with OUTPUT_LOCK:
+        if OUTPUT['jsonl'] is not None:
+            OUTPUT['jsonl'].write(json.dumps(event, ensure_ascii=False) + '\n')
+        if OUTPUT['trace'] is not None and event['type'] == 'span':
+            OUTPUT['trace'].append(event)
+
+def log(message=''):
+    """Сообщение о ходе сборки"""
+    if OUTPUT['jsonl'] is not None:
+        emit({'type': 'log', 'time': time.time(), 'message': message})
+    if getattr(OUTPUT_LOCAL, 'quiet', False):
+        return
+    if OUTPUT['quiet'] and not message.lstrip().startswith(('⚠', '❌')):
+        return
+    # Одна запись под блокировкой: строки этапов из разных потоков не склеиваются
+    with OUTPUT_LOCK:
+        sys.stdout.write(message + '\n')
+
+@contextlib.contextmanager
+def quiet_output():
+    """Отключает сообщения только в текущем потоке: sys.stdout процесса не подменяется"""
+    previous = getattr(OUTPUT_LOCAL, 'quiet', False)
+    OUTPUT_LOCAL.quiet = True
+    try:
+        yield
+    finally:
+        OUTPUT_LOCAL.quiet = previous
+
+def record_span(name, start, duration, **args):
+    """Записывает интервал, измеренный по time.perf_counter()"""
+    emit({'type': 'span', 'name': name, 'start': start, 'duration': duration,
+          'pid': os.getpid(), 'tid': threading.get_native_id(), 'args': args})
+
+@contextlib.contextmanager
+def span(name, **args):
+    """Замеряет время выполнения блока как интервал трассы"""
+    if not tracing():
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, start, time.perf_counter() - start, **args)
+
+def write_trace(path):
+    """Сохраняет интервалы в формате Chrome Trace (chrome://tracing, Perfetto)"""
+    events = [{
+        'name': event['name'],
+        'ph': 'X',
+        'ts': round(event['start'] * 1e6, 1),
+        'dur': round(event['duration'] * 1e6, 1),
+        'pid': event['pid'],
+        'tid': event['tid'],
+        'args': event['args'],
+    } for event in OUTPUT['trace'] or []]
+    write_atomic(path, json.dumps({'traceEvents': events, 'displayTimeUnit': 'ms'}))
+
+def load_fontforge():
+    """Ленивый импорт fontforge: нужен только этапам, работающим с глифами"""
+    import fontforge
+    return fontforge
+
+def mtime_or_none(path):
+    """Время изменения файла или None, если его нет"""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def toolchain_fingerprint():
+    """Отпечаток окружения: PATH, sys.path и время изменения их каталогов
+
+    Установка или удаление утилиты или пакета меняет время изменения
+    каталога, поэтому кэш проверки зависимостей сбрасывается сам.
+    """
+    path_dirs = [d for d in os.environ.get('PATH', '').split(os.pathsep) if d]
+    # Каталог самого скрипта пропускаем: в него обычно пишутся результаты сборки
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    module_dirs = [d for d in sys.path if d and os.path.isdir(d) and os.path.abspath(d) != script_dir]
+    return {
+        'python': sys.executable,
+        'dirs': {d: mtime_or_none(d) for d in path_dirs + module_dirs},
+    }
+
+def probe_toolchain():
+    """Ищет внешние утилиты и Python-модули без запуска процессов и импорта"""
+    # importlib.metadata загружается долго, а нужен только при промахе кэша окружения
+    import importlib.metadata
+    tools = {}
+    for util, capabilities in {**WOFF_UTILS, **WOFF2_UTILS}.items():
+        path = shutil.which(util)
+        if path:
+            tools[util] = {'path': path, 'mtime': mtime_or_none(path), 'capabilities': capabilities}
+
+    modules = {}
+    for name in TOOLCHAIN_MODULES:
+        spec = importlib.util.find_spec(name)
+        if spec is None:
+            continue
+        origin = spec.origin if spec.origin and os.path.exists(spec.origin) else None
+        try:
+            version = importlib.metadata.version(name)
+        except importlib.metadata.PackageNotFoundError:
+            version = None
+        modules[name] = {'origin': origin, 'mtime': mtime_or_none(origin) if origin else None, 'version': version}
+
+    return {'fingerprint': toolchain_fingerprint(), 'tools': tools, 'modules': modules}
+
+def toolchain_state_valid(state):
+    """Проверяет, что окружение и найденные файлы не изменились"""
+    if state.get('fingerprint') != toolchain_fingerprint():
+        return False
+    for item in list(state.get('tools', {}).values()) + list(state.get('modules', {}).values()):
+        origin = item.get('path') or item.get('origin')
+        if origin and mtime_or_none(origin) != item.get('mtime'):
+            return False
+    return True
+
+def load_toolchain(cache_dir=CACHE_DIR):
+    """Результат проверки зависимостей из кэша или новая проверка"""
+    state_file = os.path.join(cache_dir, 'toolchain.json') if cache_dir else None
+    if state_file:
+        try:
+            with open(state_file, encoding='utf-8') as f:
+                state = json.load(f)
+            if toolchain_state_valid(state):
+                return state
+        except (OSError, ValueError):
+            pass
+
+    state = probe_toolchain()
+    if state_file:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            write_atomic(state_file, json.dumps(state, indent=2))
+        except OSError as e:
+            log(f"⚠ Не удалось сохранить кэш зависимостей: {e}")
+    return state
+
+def python_zopfli_available(toolchain):
+    """Доступен ли модуль zopfli для встроенного кодировщика WOFF"""
+    return 'zopfli' in toolchain['modules']
+
+def python_woff2_available(toolchain):
+    """Доступны ли fontTools и brotli для встроенного кодировщика WOFF2"""
+    return 'fontTools' in toolchain['modules'] and 'brotli' in toolchain['modules']
+
+def find_woff_converter(toolchain, backend='auto'):
     """Ищет доступные утилиты для конвертации в WOFF"""
     
-    # Различные возможные имена утилит
-    woff_converters = [
-        'sfnt2woff-zopfli',
-        'sfnt2woff',
-        'woff2sfnt',
-        'woff-utils'
-    ]
+    # Встроенный кодировщик с zopfli не хуже sfnt2woff-zopfli и не требует запуска процесса
+    if backend != 'external' and python_zopfli_available(toolchain):
+        log("✅ Найден встроенный кодировщик WOFF (zopfli)")
+        return PYTHON_WOFF_ZOPFLI
+    if backend == 'python':
+        log("✅ Найден встроенный кодировщик WOFF (zlib)")
+        return PYTHON_WOFF_ZLIB
     
-    for util in woff_converters:
-        try:
-            # Проверяем существование утилиты
-            result = subprocess.run(['which', util], capture_output=True, text=True)
-            if result.returncode == 0:
-                print(f"✅ Найден конвертер WOFF: {util}")
-                return util
-        except:
-            continue
+    for util in WOFF_UTILS:
+        if util in toolchain['tools']:
+            log(f"✅ Найден конвертер WOFF: {util}")
+            return util
     
-    # Дополнительная проверка через whereis
-    try:
-        result = subprocess.run(['whereis', 'sfnt2woff'], capture_output=True, text=True)
-        if result.stdout.strip() and 'sfnt2woff' in result.stdout:
-            path = result.stdout.split()[1]
-            print(f"✅ Найден конвертер WOFF: {path}")
-            return path
-    except:
-        pass
+    # zlib есть всегда: используем его, если внешних утилит нет
+    if backend != 'external':
+        log("✅ Найден встроенный кодировщик WOFF (zlib)")
+        return PYTHON_WOFF_ZLIB
     
     return None
 
-def find_woff2_converter():
+def find_woff2_converter(toolchain, backend='auto'):
     """Ищет доступные утилиты для конвертации в WOFF2"""
     
-    woff2_converters = [
-        'woff2_compress',
-        'woff2',
-        'google-woff2'
-    ]
+    if backend != 'external' and python_woff2_available(toolchain):
+        log("✅ Найден встроенный кодировщик WOFF2 (fontTools + brotli)")
+        return PYTHON_WOFF2
+    if backend == 'python':
+        return None
     
-    for util in woff2_converters:
-        try:
-            result = subprocess.run(['which', util], capture_output=True, text=True)
-            if result.returncode == 0:
-                print(f"✅ Найден конвертер WOFF2: {util}")
-                return util
-        except:
-            continue
+    for util in WOFF2_UTILS:
+        if util in toolchain['tools']:
+            log(f"✅ Найден конвертер WOFF2: {util}")
+            return util
     
     return None
 
-def check_dependencies():
+def check_dependencies(backend='auto', cache_dir=CACHE_DIR):
     """Проверяет наличие необходимых утилит"""
-    print("\n🔍 Проверка зависимостей...")
+    log("\n🔍 Проверка зависимостей...")
     
     dependencies_ok = True
+    toolchain = load_toolchain(cache_dir)
     
-    # Проверяем FontForge
-    try:
-        import fontforge
-        print("✅ FontForge Python модуль найден")
-    except ImportError:
-        print("❌ FontForge Python модуль не найден!")
-        print("  Установите: sudo apt install fontforge python3-fontforge")
+    # Проверяем FontForge (без импорта: он нужен только при сборке глифов)
+    if 'fontforge' in toolchain['modules']:
+        log("✅ FontForge Python модуль найден")
+    else:
+        log("❌ FontForge Python модуль не найден!")
+        log("  Установите: sudo apt install fontforge python3-fontforge")
         dependencies_ok = False
     
     # Проверяем наличие WOFF конвертера
-    woff_converter = find_woff_converter()
+    woff_converter = find_woff_converter(toolchain, backend)
     if not woff_converter:
-        print("⚠ Не найден конвертер для WOFF")
-        print("  Будет создан только WOFF2 (если доступен)")
+        log("⚠ Не найден конвертер для WOFF")
+        log("  Будет создан только WOFF2 (если доступен)")
     
     # Проверяем наличие WOFF2 конвертера
-    woff2_converter = find_woff2_converter()
+    woff2_converter = find_woff2_converter(toolchain, backend)
     if not woff2_converter:
-        print("⚠ Не найден конвертер для WOFF2")
-        print("  Будет создан только WOFF (если доступен)")
+        log("⚠ Не найден конвертер для WOFF2")
+        log("  Для встроенного кодировщика: pip install fonttools brotli")
+        log("  Будет создан только WOFF (если доступен)")
     
     if not woff_converter and not woff2_converter:
-        print("❌ Не найдено ни одной утилиты для конвертации!")
-        print("  Установите утилиты:")
-        print("  sudo apt install woff2 sfnt2woff-zopfli")
+        log("❌ Не найдено ни одной утилиты для конвертации!")
+        log("  Установите утилиты:")
+        log("  sudo apt install woff2 sfnt2woff-zopfli")
         dependencies_ok = False
     
     return dependencies_ok, woff_converter, woff2_converter
 
-def convert_to_woff(ttf_file, output_base, woff_converter):
-    """Конвертация TTF в WOFF"""
-    
-    woff_file = f"{output_base}.woff"
+def scratch_dir():
+    """Приватный временный каталог, по возможности в памяти (tmpfs /dev/shm)"""
+    import tempfile
+    base = '/dev/shm' if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK) else None
+    return tempfile.TemporaryDirectory(prefix='proto-', dir=base)
+
+@contextlib.contextmanager
+def open_atomic(path, binary=False):
+    """Файл для потоковой записи: через временный файл в том же каталоге,
+    path заменяется только после успешного завершения и только если содержимое изменилось"""
+    import tempfile
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", dir=directory)
+    try:
+        with (os.fdopen(fd, 'wb') if binary else os.fdopen(fd, 'w', encoding='utf-8')) as f:
+            yield f
+        # Одинаковое содержимое не перезаписываем: время изменения и кэши CDN сохраняются
+        if os.path.exists(path) and filecmp.cmp(tmp_path, path, shallow=False):
+            os.unlink(tmp_path)
+            return
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def write_atomic(path, data):
+    """Атомарно записывает файл: через временный файл в том же каталоге"""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    with open_atomic(path, binary=True) as f:
+        f.write(data)
+
+def run_external_converter(cmd, ttf_data, suffix):
+    """Запускает внешний конвертер в приватном каталоге и возвращает результат"""
+    import subprocess
+    with scratch_dir() as tmp:
+        ttf_file = os.path.join(tmp, 'font.ttf')
+        with open(ttf_file, 'wb') as f:
+            f.write(ttf_data)
+        subprocess.run(cmd + [ttf_file], check=True, capture_output=True, text=True)
+        # Утилиты заменяют расширение исходного файла
+        with open(os.path.join(tmp, f"font{suffix}"), 'rb') as f:
+            return f.read()
+
+def convert_to_woff(ttf_data, woff_converter):
+    """Конвертация TTF в WOFF, возвращает данные WOFF или None"""
+    import subprocess
     
     if not woff_converter:
-        return False
+        return None
     
     try:
-        if 'sfnt2woff' in woff_converter:
+        if woff_converter in (PYTHON_WOFF_ZOPFLI, PYTHON_WOFF_ZLIB):
+            # Встроенный кодировщик: без запуска процесса
+            return encode_woff(ttf_data, use_zopfli=woff_converter == PYTHON_WOFF_ZOPFLI)
+        elif 'sfnt2woff' in woff_converter:
             # Для sfnt2woff и sfnt2woff-zopfli
-            cmd = [woff_converter, ttf_file]
-            result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-            
-            # Проверяем созданный файл
-            generated = f"{os.path.splitext(ttf_file)[0]}.woff"
-            if os.path.exists(generated):
-                if generated != woff_file:
-                    os.rename(generated, woff_file)
-                size = os.path.getsize(woff_file) / 1024
-                print(f"✓ Создан WOFF: {woff_file} ({size:.1f} KB)")
-                return True
+            return run_external_converter([woff_converter], ttf_data, '.woff')
         else:
             # Альтернативные методы
-            print(f"⚠ Неизвестный конвертер: {woff_converter}")
+            log(f"⚠ Неизвестный конвертер: {woff_converter}")
             
     except subprocess.CalledProcessError as e:
-        print(f"⚠ Ошибка конвертации WOFF: {e.stderr}")
+        log(f"⚠ Ошибка конвертации WOFF: {e.stderr}")
     except Exception as e:
-        print(f"⚠ Ошибка при создании WOFF: {e}")
+        log(f"⚠ Ошибка при создании WOFF: {e}")
     
-    return False
+    return None
 
-def convert_to_woff2(ttf_file, output_base, woff2_converter):
-    """Конвертация TTF в WOFF2"""
-    
-    woff2_file = f"{output_base}.woff2"
+def convert_to_woff2(ttf_data, woff2_converter):
+    """Конвертация TTF в WOFF2, возвращает данные WOFF2 или None"""
+    import subprocess
     
     if not woff2_converter:
-        return False
+        return None
     
     try:
-        if 'woff2_compress' in woff2_converter:
+        if woff2_converter == PYTHON_WOFF2:
+            # Встроенный кодировщик: без запуска процесса
+            return encode_woff2(ttf_data)
+        elif 'woff2_compress' in woff2_converter:
             # Для woff2_compress
-            cmd = [woff2_converter, ttf_file]
-            result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-            
-            # woff2_compress создает файл с расширением .woff2
-            generated = f"{ttf_file}.woff2"
-            if os.path.exists(generated):
-                if generated != woff2_file:
-                    os.rename(generated, woff2_file)
-                size = os.path.getsize(woff2_file) / 1024
-                print(f"✓ Создан WOFF2: {woff2_file} ({size:.1f} KB)")
-                return True
+            return run_external_converter([woff2_converter], ttf_data, '.woff2')
         else:
-            print(f"⚠ Неизвестный конвертер: {woff2_converter}")
+            log(f"⚠ Неизвестный конвертер: {woff2_converter}")
             
     except subprocess.CalledProcessError as e:
-        print(f"⚠ Ошибка конвертации WOFF2: {e.stderr}")
+        log(f"⚠ Ошибка конвертации WOFF2: {e.stderr}")
     except Exception as e:
-        print(f"⚠ Ошибка при создании WOFF2: {e}")
+        log(f"⚠ Ошибка при создании WOFF2: {e}")
     
-    return False
+    return None
 
-def generate_font_files(font, output_base, created_glyphs, woff_converter, woff2_converter):
-    """Генерирует файлы шрифта"""
-    
-    print("\n=== Генерация файлов шрифта ===")
+def read_sfnt_tables(data):
+    """Разбирает TTF: возвращает (версию sfnt, [(тег, контрольная сумма, данные)])"""
+    flavor, num_tables = struct.unpack('>LH', data[:6])
+    tables = []
+    for i in range(num_tables):
+        tag, checksum, offset, length = struct.unpack('>4sLLL', data[12 + i * 16:28 + i * 16])
+        tables.append((tag, checksum, data[offset:offset + length]))
+    return flavor, sorted(tables)
+
+def sfnt_checksum(data):
+    """Контрольная сумма sfnt: сумма 32-битных слов (с дополнением нулями)"""
+    data += bytes(-len(data) % 4)
+    return sum(struct.unpack(f'>{len(data) // 4}L', data)) & 0xFFFFFFFF
+
+def build_timestamp():
+    """Дата сборки для метаданных шрифта: SOURCE_DATE_EPOCH или 1970-01-01"""
+    return int(os.environ.get('SOURCE_DATE_EPOCH', 0))
+
+def deterministic_ttf(ttf_data):
+    """Фиксирует даты создания и изменения в таблице head и пересчитывает
+    контрольные суммы: одинаковые глифы дают побайтно одинаковый TTF
+
+    Дата берется из SOURCE_DATE_EPOCH (по умолчанию 1970-01-01).
+    """
+    data = bytearray(ttf_data)
+    num_tables = struct.unpack('>H', data[4:6])[0]
+    for i in range(num_tables):
+        record = 12 + i * 16
+        tag, _, offset, length = struct.unpack('>4sLLL', data[record:record + 16])
+        if tag != b'head':
+            continue
+        # Даты head — секунды с 1904-01-01
+        timestamp = build_timestamp() + 2082844800
+        struct.pack_into('>qq', data, offset + 20, timestamp, timestamp)
+        # checkSumAdjustment считается при нулевом значении самого поля
+        struct.pack_into('>L', data, offset + 8, 0)
+        struct.pack_into('>L', data, record + 4, sfnt_checksum(bytes(data[offset:offset + length])))
+        struct.pack_into('>L', data, offset + 8, (0xB1B0AFBA - sfnt_checksum(bytes(data))) & 0xFFFFFFFF)
+        break
+    return bytes(data)
+
+def encode_woff(ttf_data, use_zopfli=False, iterations=15):
+    """Кодирует TTF в WOFF 1.0 (каждая таблица сжимается zlib или zopfli)"""
+    if use_zopfli:
+        import zopfli.zlib
+        compress = lambda table: zopfli.zlib.compress(table, numiterations=iterations)
+    else:
+        compress = lambda table: zlib.compress(table, 9)
+
+    flavor, tables = read_sfnt_tables(ttf_data)
+    header_size = 44 + 20 * len(tables)
+    directory = b''
+    body = b''
+    sfnt_size = 12 + 16 * len(tables)
+    for tag, checksum, table in tables:
+        packed = compress(table)
+        # Сжатые данные сохраняются, только если они меньше исходных
+        if len(packed) >= len(table):
+            packed = table
+        directory += struct.pack('>4sLLLL', tag, header_size + len(body), len(packed), len(table), checksum)
+        body += packed + b'\0' * (-len(packed) % 4)
+        sfnt_size += len(table) + (-len(table) % 4)
+
+    version = 0
+    head = next((table for tag, _, table in tables if tag == b'head'), None)
+    if head:
+        version = struct.unpack('>L', head[4:8])[0]
+
+    header = struct.pack('>4sLLHHLHHLLLLL', b'wOFF', flavor, header_size + len(body), len(tables), 0,
+                         sfnt_size, version >> 16, version & 0xFFFF, 0, 0, 0, 0, 0)
+    return header + directory + body
+
+def encode_woff2(ttf_data, transform_tables=None, quality=11, window=22):
+    """Кодирует TTF в WOFF2 через fontTools и brotli"""
+    from fontTools.ttLib import woff2
+
+    output = io.BytesIO()
+    if quality == 11 and window == 22:
+        woff2.compress(io.BytesIO(ttf_data), output, transform_tables)
+        return output.getvalue()
+
+    # fontTools не передает параметры brotli: на время кодирования подменяем модуль
+    import brotli
+    tuned = types.SimpleNamespace(**{name: getattr(brotli, name) for name in dir(brotli) if not name.startswith('_')})
+    tuned.compress = lambda data, **options: brotli.compress(data, **dict(options, quality=quality, lgwin=window))
+    with BROTLI_PATCH_LOCK:
+        original = woff2.brotli
+        woff2.brotli = tuned
+        try:
+            woff2.compress(io.BytesIO(ttf_data), output, transform_tables)
+        finally:
+            woff2.brotli = original
+    return output.getvalue()
+
+def decode_woff(woff_data):
+    """Раскодирует WOFF 1.0: возвращает (версию sfnt, [(тег, контрольная сумма, данные)])"""
+    signature, flavor, _, num_tables = struct.unpack('>4sLLH', woff_data[:14])
+    if signature != b'wOFF':
+        raise ValueError("не WOFF")
+    tables = []
+    for i in range(num_tables):
+        tag, offset, comp_length, orig_length, checksum = struct.unpack(
+            '>4sLLLL', woff_data[44 + i * 20:64 + i * 20])
+        table = woff_data[offset:offset + comp_length]
+        if comp_length < orig_length:
+            table = zlib.decompress(table)
+        tables.append((tag, checksum, table))
+    return flavor, sorted(tables)
+
+def verify_round_trip(ttf_data, encoded):
+    """Проверяет, что WOFF/WOFF2 раскодируется в тот же шрифт
+
+    Возвращает None, если проверить нечем (WOFF2 без fontTools).
+    """
+    if encoded[:4] == b'wOFF':
+        return decode_woff(encoded) == read_sfnt_tables(ttf_data)
 
-    # Создаем временный TTF файл
-    ttf_file = f"{output_base}.ttf"
-    
     try:
-        # Генерируем TTF
-        font.generate(ttf_file)
-        print(f"✓ Создан временный TTF: {ttf_file}")
-        
-        if os.path.exists(ttf_file):
-            size = os.path.getsize(ttf_file) / 1024
-            print(f"  Размер TTF: {size:.1f} KB")
-    except Exception as e:
-        print(f"❌ Ошибка создания TTF: {e}")
+        from fontTools.ttLib import TTFont
+    except ImportError:
+        return None
+
+    source = TTFont(io.BytesIO(ttf_data))
+    decoded = TTFont(io.BytesIO(encoded))
+    if sorted(source.reader.keys()) != sorted(decoded.reader.keys()):
         return False
+    # glyf, loca и hmtx WOFF2 хранит в преобразованном виде, head и DSIG меняются при кодировании
+    for tag in source.reader.keys():
+        if tag not in ('glyf', 'loca', 'hmtx', 'head', 'DSIG') and source.reader[tag] != decoded.reader[tag]:
+            return False
+    if 'hmtx' in source and source['hmtx'].metrics != decoded['hmtx'].metrics:
+        return False
+    if 'glyf' in source:
+        source_glyf, decoded_glyf = source['glyf'], decoded['glyf']
+        for name in source.getGlyphOrder():
+            coords, ends, flags = source_glyf[name].getCoordinates(source_glyf)
+            other_coords, other_ends, other_flags = decoded_glyf[name].getCoordinates(decoded_glyf)
+            if (list(coords) != list(other_coords) or list(ends) != list(other_ends)
+                    or [f & 1 for f in flags] != [f & 1 for f in other_flags]):
+                return False
+    return True
 
-    # Конвертируем в WOFF и WOFF2
-    woff_created = convert_to_woff(ttf_file, output_base, woff_converter) if woff_converter else False
-    woff2_created = convert_to_woff2(ttf_file, output_base, woff2_converter) if woff2_converter else False
-    
-    # Удаляем временный TTF файл
+def compression_candidates(fmt, toolchain):
+    """Все доступные варианты кодирования для турнира: [(название, функция)]"""
+    candidates = []
+    if fmt == 'woff':
+        candidates.append(('zlib -9', lambda data: encode_woff(data)))
+        if python_zopfli_available(toolchain):
+            for iterations in (15, 100, 500):
+                candidates.append((f"zopfli ×{iterations}",
+                                   lambda data, n=iterations: encode_woff(data, use_zopfli=True, iterations=n)))
+        for util, capabilities in WOFF_UTILS.items():
+            if util not in toolchain['tools'] or 'sfnt2woff' not in util:
+                continue
+            if 'zopfli' in capabilities:
+                for iterations in (15, 100):
+                    candidates.append((f"{util} -n {iterations}",
+                                       lambda data, u=util, n=iterations: run_external_converter(
+                                           [u, '-n', str(n)], data, '.woff')))
+            else:
+                candidates.append((util, lambda data, u=util: run_external_converter([u], data, '.woff')))
+    else:
+        if python_woff2_available(toolchain):
+            for transforms, label in ((None, 'glyf+loca'), ((), 'без преобразований'),
+                                      (('glyf', 'loca', 'hmtx'), 'glyf+loca+hmtx')):
+                for quality, window in ((11, 22), (11, 24), (11, 18), (10, 22)):
+                    candidates.append((f"brotli q{quality} w{window}, {label}",
+                                       lambda data, t=transforms, q=quality, w=window: encode_woff2(data, t, q, w)))
+        if 'woff2_compress' in toolchain['tools']:
+            candidates.append(('woff2_compress',
+                               lambda data: run_external_converter(['woff2_compress'], data, '.woff2')))
+    return candidates
+
+def compress_tournament(ttf_data, fmt, cache_dir=CACHE_DIR):
+    """Режим максимального сжатия: пробует все кодировщики и настройки,
+    проверяет каждый результат раскодированием и оставляет самый маленький.
+    Победитель кэшируется по хэшу TTF, так что перебор выполняется один раз."""
+    digest = ttf_digest(ttf_data)
+    result_dir = os.path.join(cache_dir, 'compression') if cache_dir else None
+    if result_dir:
+        try:
+            with open(os.path.join(result_dir, f"{digest}.{fmt}"), 'rb') as f:
+                data = f.read()
+            log(f"✓ {fmt.upper()}: результат турнира сжатия из кэша ({len(data) / 1024:.1f} KB)")
+            return data
+        except OSError:
+            pass
+
+    candidates = compression_candidates(fmt, load_toolchain(cache_dir))
+    results = []
+    for name, encode in candidates:
+        try:
+            data = encode(ttf_data)
+            verified = verify_round_trip(ttf_data, data)
+        except Exception as e:
+            log(f"  ⚠ {fmt.upper()} {name}: {e}")
+            continue
+        # Непроверяемый результат допускаем, только если других нет
+        if verified is False or verified is None and len(candidates) > 1:
+            log(f"  ⚠ {fmt.upper()} {name}: не прошел проверку раскодированием")
+            continue
+        results.append((len(data), name, data))
+
+    if not results:
+        return None
+
+    results.sort(key=lambda item: item[0])
+    log(f"🏆 Турнир сжатия {fmt.upper()}:")
+    for i, (size, name, _) in enumerate(results):
+        log(f"  {'★' if i == 0 else ' '} {name:<40} {size:>9} B")
+
+    size, name, data = results[0]
+    if result_dir:
+        try:
+            os.makedirs(result_dir, exist_ok=True)
+            write_atomic(os.path.join(result_dir, f"{digest}.{fmt}"), data)
+            write_atomic(os.path.join(result_dir, f"{digest}.{fmt}.json"),
+                         json.dumps({'winner': name, 'results': [[n, s] for s, n, _ in results]}, indent=2))
+        except OSError as e:
+            log(f"⚠ Не удалось сохранить результат турнира: {e}")
+    return data
+
+def file_digest(path):
+    """SHA-256 содержимого файла"""
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def ttf_digest(ttf_data):
+    """Хэш TTF без меток времени (head.created/modified, таблица FFTM)"""
+    _, tables = read_sfnt_tables(ttf_data)
+
+    digest = hashlib.sha256()
+    for tag, _, table in tables:
+        if tag == b'FFTM':
+            continue
+        if tag == b'head':
+            # checkSumAdjustment и даты создания/изменения меняются при каждой сборке
+            table = bytearray(table)
+            table[8:12] = bytes(4)
+            table[20:36] = bytes(16)
+        digest.update(tag)
+        digest.update(struct.pack('>L', len(table)))
+        digest.update(table)
+    return digest.hexdigest()
+
+def glyph_cache_key(svg_path, settings):
+    """Ключ кэша глифа: содержимое SVG + параметры обработки"""
+    digest = hashlib.sha256()
+    with open(svg_path, 'rb') as f:
+        digest.update(f.read())
+    glyph_settings = {name: value for name, value in settings.items() if name not in FONT_SETTINGS}
+    digest.update(json.dumps({'version': CACHE_VERSION, **glyph_settings}, sort_keys=True).encode())
+    return digest.hexdigest()
+
+def glyph_outline_data(glyph):
+    """Извлекает контуры и метрики глифа в виде простых данных"""
+    layer = glyph.foreground
+    contours = []
+    for contour in layer:
+        contours.append({
+            'closed': contour.closed,
+            'points': [[p.x, p.y, p.on_curve] for p in contour],
+        })
+    return {
+        'quadratic': layer.is_quadratic,
+        'width': glyph.width,
+        'contours': contours,
+    }
+
+def apply_outline_data(glyph, data):
+    """Восстанавливает контуры и метрики глифа из простых данных"""
+    fontforge = load_fontforge()
+    layer = fontforge.layer()
+    layer.is_quadratic = data['quadratic']
+    for item in data['contours']:
+        contour = fontforge.contour()
+        contour.is_quadratic = data['quadratic']
+        for x, y, on_curve in item['points']:
+            contour += fontforge.point(x, y, on_curve)
+        contour.closed = item['closed']
+        layer += contour
+    glyph.foreground = layer
+    glyph.width = data['width']
+
+def load_cached_glyph(cache_dir, key):
+    """Читает обработанный глиф из кэша (None, если его нет)"""
+    if not cache_dir:
+        return None
+    path = os.path.join(cache_dir, 'glyphs', f"{key}.json")
     try:
-        os.remove(ttf_file)
-        print(f"✓ Временный TTF файл удален")
-    except Exception as e:
-        print(f"⚠ Не удалось удалить TTF: {e}")
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def store_cached_glyph(cache_dir, key, data):
+    """Сохраняет обработанный глиф в кэш"""
+    if not cache_dir:
+        return
+    glyphs_dir = os.path.join(cache_dir, 'glyphs')
+    try:
+        os.makedirs(glyphs_dir, exist_ok=True)
+        tmp_path = os.path.join(glyphs_dir, f"{key}.json.tmp{os.getpid()}")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp_path, os.path.join(glyphs_dir, f"{key}.json"))
+    except OSError as e:
+        log(f"⚠ Не удалось записать кэш глифа: {e}")
 
-    return woff_created or woff2_created
+def load_build_state(cache_dir, output_base):
+    """Состояние последней сборки: хэш TTF и хэши созданных файлов"""
+    if not cache_dir:
+        return {}
+    path = os.path.join(cache_dir, f"{output_base}.build.json")
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
-def create_font_with_mapping(svg_dir, output_base, mapping, woff_converter, woff2_converter):
-    """Создает шрифт из SVG файлов"""
+def store_build_state(cache_dir, output_base, state):
+    """Сохраняет состояние сборки"""
+    if not cache_dir:
+        return
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(os.path.join(cache_dir, f"{output_base}.build.json"), 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=2)
+    except OSError as e:
+        log(f"⚠ Не удалось сохранить состояние сборки: {e}")
+
+def outputs_up_to_date(state, ttf_hash):
+    """Проверяет, что WOFF/WOFF2 собраны из того же TTF и не изменялись"""
+    if not state or state.get('ttf') != ttf_hash or not state.get('outputs'):
+        return False
+    for path, digest in state['outputs'].items():
+        if not os.path.exists(path) or file_digest(path) != digest:
+            return False
+    return True
+
+def outline_points(glyph):
+    """Координаты точек контуров глифа по контурам"""
+    return [[(p.x, p.y, p.on_curve) for p in contour] for contour in glyph.foreground]
+
+def estimate_glyf_bytes(contours):
+    """Оценка размера глифа в таблице glyf: заголовок, концы контуров,
+    флаг на точку и дельты координат в 0, 1 или 2 байта"""
+    points = [point for contour in contours for point in contour]
+    if not points:
+        return 0
+    size = 10 + 2 * len(contours) + 2 + len(points)
+    x = y = 0
+    for px, py, _ in points:
+        dx, dy = round(px) - x, round(py) - y
+        x, y = round(px), round(py)
+        size += (0 if dx == 0 else 1 if abs(dx) < 256 else 2) + (0 if dy == 0 else 1 if abs(dy) < 256 else 2)
+    return size
+
+def apply_outline_ops(target, settings, make_quadratic):
+    """Упрощение и округление контуров: target — глиф или шрифт (тогда — его выделение)
+
+    make_quadratic() переводит контуры в квадратичные кривые между упрощением и округлением.
+    """
+    if settings.get('remove_overlap'):
+        target.removeOverlap()
+
+    if settings.get('simplify'):
+        flags = []
+        if settings.get('merge_lines'):
+            flags.append('mergelines')
+        if settings.get('remove_singletons'):
+            flags.append('removesingletonpoints')
+        error = settings.get('simplify_error')
+        with span('simplify'):
+            if error is not None or flags:
+                target.simplify(1.0 if error is None else error, tuple(flags))
+            else:
+                target.simplify()
+
+    if settings.get('quadratic'):
+        make_quadratic()
+
+    quantize = settings.get('quantize', 1)
+    if quantize > 1:
+        # Округление до сетки крупнее единицы: масштабируем, округляем, возвращаем масштаб
+        target.transform((1.0 / quantize, 0, 0, 1.0 / quantize, 0, 0))
+        target.round()
+        target.transform((quantize, 0, 0, quantize, 0, 0))
+    elif settings.get('round'):
+        target.round()
+
+def outline_report(before, after):
+    """Отчет оптимизации: число точек и оценка размера glyf до и после"""
+    return {
+        'points_before': sum(len(contour) for contour in before),
+        'points_after': sum(len(contour) for contour in after),
+        'bytes_before': estimate_glyf_bytes(before),
+        'bytes_after': estimate_glyf_bytes(after),
+    }
+
+def make_glyph_quadratic(glyph):
+    """Переводит контуры глифа в квадратичные кривые (одинаково в обоих режимах обработки)"""
+    layer = glyph.foreground
+    layer.is_quadratic = True
+    glyph.foreground = layer
+
+def optimize_glyph(glyph, settings):
+    """Оптимизирует контуры глифа по настройкам, возвращает отчет до/после"""
+    before = outline_points(glyph)
+    apply_outline_ops(glyph, settings, lambda: make_glyph_quadratic(glyph))
+    return outline_report(before, outline_points(glyph))
+
+# Нормализация SVG: только залитая геометрия в единицах em, без групп и трансформаций
+SVG_NORMALIZE_VERSION = 1
+SVG_NS = '{http://www.w3.org/2000/svg}'
+XLINK_HREF = '{http://www.w3.org/1999/xlink}href'
+# Элементы, не дающие контуров глифа
+SVG_SKIP_TAGS = {'defs', 'metadata', 'title', 'desc', 'style', 'script', 'clipPath', 'mask', 'marker',
+                 'pattern', 'linearGradient', 'radialGradient', 'filter', 'symbol', 'foreignObject'}
+SVG_NUMBER_RE = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+SVG_PATH_TOKEN_RE = re.compile(r'[MmZzLlHhVvCcSsQqTtAa]|[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+SVG_TRANSFORM_RE = re.compile(r'(matrix|translate|scale|rotate|skewX|skewY)\s*\(([^)]*)\)')
+IDENTITY = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+
+def load_numpy():
+    """numpy, если установлен (иначе координаты пересчитываются на чистом Python)"""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+def compose(outer, inner):
+    """Композиция аффинных преобразований (a, b, c, d, e, f): сначала inner, затем outer"""
+    a1, b1, c1, d1, e1, f1 = outer
+    a2, b2, c2, d2, e2, f2 = inner
+    return (a1 * a2 + c1 * b2, b1 * a2 + d1 * b2,
+            a1 * c2 + c1 * d2, b1 * c2 + d1 * d2,
+            a1 * e2 + c1 * f2 + e1, b1 * e2 + d1 * f2 + f1)
+
+def parse_transform(text):
+    """Атрибут transform → матрица (a, b, c, d, e, f)"""
+    matrix = IDENTITY
+    for name, args in SVG_TRANSFORM_RE.findall(text or ''):
+        values = [float(value) for value in SVG_NUMBER_RE.findall(args)]
+        if name == 'matrix' and len(values) == 6:
+            step = tuple(values)
+        elif name == 'translate' and values:
+            step = (1.0, 0.0, 0.0, 1.0, values[0], values[1] if len(values) > 1 else 0.0)
+        elif name == 'scale' and values:
+            step = (values[0], 0.0, 0.0, values[1] if len(values) > 1 else values[0], 0.0, 0.0)
+        elif name == 'rotate' and values:
+            angle = math.radians(values[0])
+            cos, sin = math.cos(angle), math.sin(angle)
+            step = (cos, sin, -sin, cos, 0.0, 0.0)
+            if len(values) == 3:
+                cx, cy = values[1], values[2]
+                step = compose((1.0, 0.0, 0.0, 1.0, cx, cy), compose(step, (1.0, 0.0, 0.0, 1.0, -cx, -cy)))
+        elif name == 'skewX' and values:
+            step = (1.0, 0.0, math.tan(math.radians(values[0])), 1.0, 0.0, 0.0)
+        elif name == 'skewY' and values:
+            step = (1.0, math.tan(math.radians(values[0])), 0.0, 1.0, 0.0, 0.0)
+        else:
+            continue
+        matrix = compose(matrix, step)
+    return matrix
+
+def svg_length(value, default=0.0):
+    """Длина из атрибута SVG (единицы измерения отбрасываются)"""
+    match = SVG_NUMBER_RE.match((value or '').strip())
+    return float(match.group()) if match else default
+
+def arc_commands(start, end, rx, ry, angle, large, sweep):
+    """Дуга эллипса SVG → кубические кривые не больше 90° каждая"""
+    if start == end:
+        return []
+    if not rx or not ry:
+        return [('L', [end])]
+    (x1, y1), (x2, y2) = start, end
+    phi = math.radians(angle)
+    cos_phi, sin_phi = math.cos(phi), math.sin(phi)
+
+    # Переход к параметризации через центр (SVG 1.1, приложение F.6.5)
+    hx, hy = (x1 - x2) / 2, (y1 - y2) / 2
+    x1p = cos_phi * hx + sin_phi * hy
+    y1p = -sin_phi * hx + cos_phi * hy
+    excess = (x1p / rx) ** 2 + (y1p / ry) ** 2
+    if excess > 1:
+        rx, ry = rx * math.sqrt(excess), ry * math.sqrt(excess)
+    numerator = rx * rx * ry * ry - rx * rx * y1p * y1p - ry * ry * x1p * x1p
+    denominator = rx * rx * y1p * y1p + ry * ry * x1p * x1p
+    coef = math.sqrt(max(0.0, numerator / denominator)) if denominator else 0.0
+    if large == sweep:
+        coef = -coef
+    cxp, cyp = coef * rx * y1p / ry, -coef * ry * x1p / rx
+    cx = cos_phi * cxp - sin_phi * cyp + (x1 + x2) / 2
+    cy = sin_phi * cxp + cos_phi * cyp + (y1 + y2) / 2
+
+    theta = math.atan2((y1p - cyp) / ry, (x1p - cxp) / rx)
+    delta = math.atan2((-y1p - cyp) / ry, (-x1p - cxp) / rx) - theta
+    if sweep and delta < 0:
+        delta += 2 * math.pi
+    elif not sweep and delta > 0:
+        delta -= 2 * math.pi
+
+    segments = max(1, math.ceil(abs(delta) / (math.pi / 2) - 1e-9))
+    step = delta / segments
+    k = 4 / 3 * math.tan(step / 4)
+
+    def point(t):
+        ex, ey = rx * math.cos(t), ry * math.sin(t)
+        return cx + cos_phi * ex - sin_phi * ey, cy + sin_phi * ex + cos_phi * ey
+
+    def tangent(t):
+        ex, ey = -rx * math.sin(t), ry * math.cos(t)
+        return cos_phi * ex - sin_phi * ey, sin_phi * ex + cos_phi * ey
+
+    commands = []
+    for i in range(segments):
+        t0, t1 = theta + i * step, theta + (i + 1) * step
+        p0, d0 = point(t0), tangent(t0)
+        p3, d3 = point(t1), tangent(t1)
+        commands.append(('C', [(p0[0] + k * d0[0], p0[1] + k * d0[1]),
+                               (p3[0] - k * d3[0], p3[1] - k * d3[1]), p3]))
+    commands[-1][1][2] = end
+    return commands
+
+def parse_path(d):
+    """Атрибут d → абсолютные команды M, L, C, Z (дуги и квадратичные кривые — через кубические)"""
+    tokens = SVG_PATH_TOKEN_RE.findall(d or '')
+    commands = []
+    pos = 0
+    x = y = start_x = start_y = 0.0
+    cubic_control = quad_control = None
+    command = None
+
+    def number():
+        nonlocal pos
+        value = float(tokens[pos])
+        pos += 1
+        return value
+
+    def flag():
+        # Флаги дуги могут быть записаны слитно с числом: "a5 5 0 01 10 0"
+        nonlocal pos
+        token = tokens[pos]
+        if len(token) > 1:
+            tokens[pos] = token[1:]
+        else:
+            pos += 1
+        return token[0] == '1'
+
+    while pos < len(tokens):
+        if tokens[pos].isalpha():
+            command = tokens[pos]
+            pos += 1
+        elif command is None:
+            raise ValueError(f"неверный путь: {d[:40]}")
+        relative = command.islower()
+        op = command.upper()
+        dx, dy = (x, y) if relative else (0.0, 0.0)
+        # После Z рисование без M продолжается с начала закрытого контура
+        if commands and commands[-1][0] == 'Z' and op not in 'MZ':
+            commands.append(('M', [(x, y)]))
+
+        if op == 'Z':
+            commands.append(('Z', []))
+            x, y = start_x, start_y
+            cubic_control = quad_control = None
+            command = None
+            continue
+        if op == 'M':
+            x, y = dx + number(), dy + number()
+            start_x, start_y = x, y
+            commands.append(('M', [(x, y)]))
+            # Следующие пары чисел после M — отрезки
+            command = 'l' if relative else 'L'
+        elif op == 'L':
+            x, y = dx + number(), dy + number()
+            commands.append(('L', [(x, y)]))
+        elif op == 'H':
+            x = dx + number()
+            commands.append(('L', [(x, y)]))
+        elif op == 'V':
+            y = dy + number()
+            commands.append(('L', [(x, y)]))
+        elif op in 'CS':
+            if op == 'C':
+                c1 = (dx + number(), dy + number())
+            elif cubic_control:
+                c1 = (2 * x - cubic_control[0], 2 * y - cubic_control[1])
+            else:
+                c1 = (x, y)
+            c2 = (dx + number(), dy + number())
+            end = (dx + number(), dy + number())
+            commands.append(('C', [c1, c2, end]))
+            x, y = end
+        elif op in 'QT':
+            if op == 'Q':
+                q = (dx + number(), dy + number())
+            elif quad_control:
+                q = (2 * x - quad_control[0], 2 * y - quad_control[1])
+            else:
+                q = (x, y)
+            end = (dx + number(), dy + number())
+            commands.append(('C', [(x + 2 / 3 * (q[0] - x), y + 2 / 3 * (q[1] - y)),
+                                   (end[0] + 2 / 3 * (q[0] - end[0]), end[1] + 2 / 3 * (q[1] - end[1])), end]))
+            x, y = end
+        elif op == 'A':
+            rx, ry, angle = abs(number()), abs(number()), number()
+            large, sweep = flag(), flag()
+            end = (dx + number(), dy + number())
+            commands.extend(arc_commands((x, y), end, rx, ry, angle, large, sweep))
+            x, y = end
+        cubic_control = c2 if op in 'CS' else None
+        quad_control = q if op in 'QT' else None
+    return commands
+
+def shape_path(element, tag):
+    """Путь (атрибут d) для базовой фигуры SVG; None — у фигуры нет площади"""
+    attr = lambda name: svg_length(element.get(name))
+    if tag == 'rect':
+        x, y, w, h = attr('x'), attr('y'), attr('width'), attr('height')
+        if w <= 0 or h <= 0:
+            return None
+        rx, ry = element.get('rx'), element.get('ry')
+        rx = svg_length(rx if rx is not None else ry)
+        ry = svg_length(ry if ry is not None else element.get('rx'))
+        rx, ry = min(rx, w / 2), min(ry, h / 2)
+        if not rx or not ry:
+            return f"M{x},{y}H{x + w}V{y + h}H{x}Z"
+        return (f"M{x + rx},{y}H{x + w - rx}A{rx},{ry} 0 0 1 {x + w},{y + ry}V{y + h - ry}"
+                f"A{rx},{ry} 0 0 1 {x + w - rx},{y + h}H{x + rx}A{rx},{ry} 0 0 1 {x},{y + h - ry}"
+                f"V{y + ry}A{rx},{ry} 0 0 1 {x + rx},{y}Z")
+    if tag in ('circle', 'ellipse'):
+        cx, cy = attr('cx'), attr('cy')
+        rx = attr('r') if tag == 'circle' else attr('rx')
+        ry = attr('r') if tag == 'circle' else attr('ry')
+        if rx <= 0 or ry <= 0:
+            return None
+        return f"M{cx - rx},{cy}A{rx},{ry} 0 1 0 {cx + rx},{cy}A{rx},{ry} 0 1 0 {cx - rx},{cy}Z"
+    if tag in ('polygon', 'polyline'):
+        # Залитая ломаная замыкается так же, как многоугольник
+        values = SVG_NUMBER_RE.findall(element.get('points', ''))
+        if len(values) < 6:
+            return None
+        return "M" + " ".join(values) + "Z"
+    return None
+
+def element_style(element, inherited):
+    """Свойства оформления элемента: атрибуты и style поверх унаследованных"""
+    style = dict(inherited)
+    style.pop('display', None)
+    for name in ('fill', 'fill-rule', 'stroke', 'display', 'visibility', 'fill-opacity'):
+        if element.get(name) is not None:
+            style[name] = element.get(name).strip()
+    for declaration in (element.get('style') or '').split(';'):
+        name, _, value = declaration.partition(':')
+        if value:
+            style[name.strip()] = value.strip()
+    return style
+
+def transform_points(points, matrices, numpy=None):
+    """Применяет к каждой точке свое аффинное преобразование — одним проходом по всему массиву"""
+    if numpy is not None and points:
+        p = numpy.asarray(points, dtype=float)
+        m = numpy.asarray(matrices, dtype=float)
+        x = m[:, 0] * p[:, 0] + m[:, 2] * p[:, 1] + m[:, 4]
+        y = m[:, 1] * p[:, 0] + m[:, 3] * p[:, 1] + m[:, 5]
+        return numpy.column_stack((x, y)).tolist()
+    return [(a * x + c * y + e, b * x + d * y + f) for (x, y), (a, b, c, d, e, f) in zip(points, matrices)]
+
+def svg_number(value):
+    """Короткая запись координаты: два знака после запятой без хвостовых нулей"""
+    text = f"{value:.2f}".rstrip('0').rstrip('.')
+    return '0' if text == '-0' else text
+
+def svg_outline(svg_data, em=1000, name='SVG'):
+    """Залитая геометрия SVG в единицах em: (ширина, разметка элементов path)
+
+    Группы, use и трансформации раскрываются, фигуры переводятся в пути,
+    все, что не является залитой геометрией, отбрасывается. Высота viewBox
+    масштабируется до em: y = 0 — линия ascent, y = em — линия descent.
+    """
+    import xml.etree.ElementTree as ElementTree
+    root = ElementTree.fromstring(svg_data)
+    view_box = [float(value) for value in SVG_NUMBER_RE.findall(root.get('viewBox', ''))]
+    if len(view_box) == 4 and view_box[3] > 0:
+        vb_x, vb_y, vb_width, vb_height = view_box
+    else:
+        vb_x = vb_y = 0.0
+        vb_width = svg_length(root.get('width'), em)
+        vb_height = svg_length(root.get('height'), em)
+    scale = em / vb_height
+    normalize = (scale, 0.0, 0.0, scale, -vb_x * scale, -vb_y * scale)
+
+    ids = {element.get('id'): element for element in root.iter() if element.get('id')}
+    shapes = []
+    warnings = []
+
+    def walk(element, matrix, inherited, used_ids):
+        tag = element.tag.replace(SVG_NS, '')
+        if tag in SVG_SKIP_TAGS:
+            return
+        style = element_style(element, inherited)
+        if style.get('display') == 'none':
+            return
+        matrix = compose(matrix, parse_transform(element.get('transform')))
+
+        if tag in ('svg', 'g', 'a', 'switch'):
+            for child in element:
+                walk(child, matrix, style, used_ids)
+            return
+        if tag == 'use':
+            ref = (element.get('href') or element.get(XLINK_HREF) or '').lstrip('#')
+            target = ids.get(ref)
+            if target is None or ref in used_ids:
+                warnings.append(f"ссылка use на #{ref} не найдена")
+                return
+            offset = (1.0, 0.0, 0.0, 1.0, svg_length(element.get('x')), svg_length(element.get('y')))
+            # symbol раскрывается как группа
+            children = list(target) if target.tag.replace(SVG_NS, '') == 'symbol' else [target]
+            for child in children:
+                walk(child, compose(matrix, offset), style, used_ids | {ref})
+            return
+        if tag == 'line':
+            warnings.append("line без площади пропущен")
+            return
+        if tag == 'text':
+            warnings.append("текст не поддерживается — переведите его в кривые")
+            return
+
+        d = element.get('d') if tag == 'path' else shape_path(element, tag)
+        if not d or style.get('visibility') == 'hidden':
+            return
+        if style.get('fill') == 'none' or style.get('fill-opacity') in ('0', '0.0'):
+            if style.get('stroke') not in (None, 'none'):
+                warnings.append(f"{tag} только с обводкой пропущен — переведите обводку в контур")
+            return
+        shapes.append((parse_path(d), matrix, style.get('fill-rule', 'nonzero')))
+
+    walk(root, normalize, {}, frozenset())
+
+    # Все точки файла пересчитываются одним пакетом
+    points, matrices = [], []
+    for commands, matrix, _ in shapes:
+        for _, command_points in commands:
+            points.extend(command_points)
+            matrices.extend([matrix] * len(command_points))
+    transformed = iter(transform_points(points, matrices, load_numpy()))
+
+    paths = {}
+    for commands, _, fill_rule in shapes:
+        parts = paths.setdefault(fill_rule, [])
+        for op, command_points in commands:
+            parts.append(op + ' '.join(f"{svg_number(x)},{svg_number(y)}"
+                                       for x, y in (next(transformed) for _ in command_points)))
+
+    width = svg_number(vb_width * scale)
+    body = ''.join(f'<path d="{"".join(parts)}"' + (' fill-rule="evenodd"' if rule == 'evenodd' else '') + '/>'
+                   for rule, parts in paths.items() if parts)
+    for warning in warnings:
+        log(f"⚠ {name}: {warning}")
+    return width, body
+
+def normalize_svg(svg_data, em=1000, name='SVG'):
+    """Переписывает SVG в виде путей в единицах em (см. svg_outline)"""
+    width, body = svg_outline(svg_data, em, name)
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {em}" '
+            f'width="{width}" height="{em}">{body}</svg>\n')
+
+@contextlib.contextmanager
+def import_source(svg_path, settings, cache_dir=CACHE_DIR):
+    """Путь к SVG для импорта: исходный или нормализованный (кэшируется в .proto_cache/svg/)"""
+    if not settings.get('normalize_svg'):
+        yield svg_path
+        return
+
+    with open(svg_path, 'rb') as f:
+        svg_data = f.read()
+    digest = hashlib.sha256(svg_data)
+    digest.update(json.dumps({'version': SVG_NORMALIZE_VERSION, 'em': settings['em']}).encode())
+    cached_path = os.path.join(cache_dir, 'svg', f"{digest.hexdigest()}.svg") if cache_dir else None
+    if cached_path and os.path.exists(cached_path):
+        yield cached_path
+        return
+
+    with span('normalize'):
+        normalized = normalize_svg(svg_data, settings['em'], os.path.basename(svg_path))
+    if cached_path:
+        os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+        write_atomic(cached_path, normalized)
+        yield cached_path
+    else:
+        with scratch_dir() as tmp:
+            path = os.path.join(tmp, os.path.basename(svg_path))
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(normalized)
+            yield path
+
+def process_glyph(glyph, svg_path, settings, cache_dir=CACHE_DIR):
+    """Импортирует SVG в глиф, вычисляет ширину и оптимизирует контуры"""
+    with import_source(svg_path, settings, cache_dir) as source, span('import'):
+        glyph.importOutlines(source)
+
+    # Вычисляем ширину
+    glyph.width = glyph_width(glyph.boundingBox())
+
+    # Оптимизируем
+    return optimize_glyph(glyph, settings)
+
+def glyph_width(bbox):
+    """Ширина глифа по габаритам: правый край контуров плюс отступ"""
+    if bbox and len(bbox) >= 4:
+        return int(bbox[2]) + 50
+    return 600
+
+def process_glyphs_batch(font, items, settings, cache_dir=CACHE_DIR):
+    """Пакетная обработка (--batch-ops): импорт всех SVG, ширины одним проходом
+    по габаритам и оптимизация одной операцией над выделением шрифта
+
+    items — [(символ, путь к SVG)]. Возвращает [(символ, отчет, ошибка)].
+    """
+    glyphs = {}
+    errors = {}
+    for char, svg_path in items:
+        try:
+            glyph = font.createChar(ord(char))
+            with import_source(svg_path, settings, cache_dir) as source, span('import'):
+                glyph.importOutlines(source)
+            glyphs[char] = glyph
+        except Exception as e:
+            errors[char] = str(e)
+
+    bounds = {char: glyph.boundingBox() for char, glyph in glyphs.items()}
+    for char, glyph in glyphs.items():
+        glyph.width = glyph_width(bounds[char])
+
+    before = {char: outline_points(glyph) for char, glyph in glyphs.items()}
+    if glyphs:
+        font.selection.select(*(glyph.glyphname for glyph in glyphs.values()))
+
+        def make_quadratic():
+            # Тот же перевод, что и при обработке по одному: тип слоя всего шрифта не меняется
+            for glyph in glyphs.values():
+                make_glyph_quadratic(glyph)
+
+        with span('batch_ops', glyphs=len(glyphs)):
+            apply_outline_ops(font, settings, make_quadratic)
+        font.selection.none()
+
+    return [(char, outline_report(before[char], outline_points(glyphs[char])) if char in glyphs else None,
+             errors.get(char)) for char, svg_path in items]
+
+def print_optimization_report(reports, mapping):
+    """Печатает число точек и оценку размера глифов до и после оптимизации"""
+    if not reports:
+        return
+    log("\n📉 Оптимизация контуров (точки, байты glyf — оценка):")
+    rows = sorted(reports.items(), key=lambda item: item[1]['bytes_before'] - item[1]['bytes_after'], reverse=True)
+    for char, report in rows:
+        log(f"  {char} {mapping[char]:<24} {report['points_before']:>5} → {report['points_after']:<5} "
+              f"{report['bytes_before']:>6} → {report['bytes_after']:<6} B")
+    before = sum(report['bytes_before'] for report in reports.values())
+    after = sum(report['bytes_after'] for report in reports.values())
+    points_before = sum(report['points_before'] for report in reports.values())
+    points_after = sum(report['points_after'] for report in reports.values())
+    saved = 100 * (before - after) / before if before else 0
+    log(f"  Итого: точек {points_before} → {points_after}, байт {before} → {after} (−{saved:.0f}%)")
+
+def run_stages(stages, max_workers=None):
+    """Выполняет этапы сборки по графу зависимостей
+
+    stages — словарь {имя: (зависимости, функция)}. Функция получает словарь
+    результатов уже выполненных этапов; независимые этапы выполняются
+    одновременно в пуле потоков. Этапы, зависящие от упавшего, пропускаются.
+    Возвращает (результаты, тайминги {имя: (начало, конец)}).
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+    results = {}
+    timings = {}
+    failed = set()
+    running = {}
+    remaining = dict(stages)
+
+    def run(name, func):
+        start = time.perf_counter()
+        try:
+            with span(name):
+                return func(results)
+        finally:
+            timings[name] = (start, time.perf_counter())
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(stages) or 1) as pool:
+        while remaining or running:
+            # Пропускаем этапы, зависящие от упавших
+            for name, (deps, func) in list(remaining.items()):
+                if any(dep in failed for dep in deps):
+                    log(f"⚠ Этап {name} пропущен: не выполнены зависимости")
+                    failed.add(name)
+                    del remaining[name]
+
+            # Запускаем этапы, все зависимости которых выполнены
+            for name, (deps, func) in list(remaining.items()):
+                if all(dep in results for dep in deps):
+                    running[pool.submit(run, name, func)] = name
+                    del remaining[name]
+
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    log(f"❌ Ошибка на этапе {name}: {e}")
+                    failed.add(name)
+
+    return results, timings
+
+def critical_path(stages, timings):
+    """Самая длинная по времени цепочка зависимых этапов"""
+    memo = {}
+
+    def longest(name):
+        if name not in memo:
+            start, end = timings[name]
+            deps = [dep for dep in stages[name][0] if dep in timings]
+            best = max((longest(dep) for dep in deps), key=lambda item: item[0], default=(0.0, []))
+            memo[name] = (best[0] + end - start, best[1] + [name])
+        return memo[name]
+
+    return max((longest(name) for name in timings), key=lambda item: item[0], default=(0.0, []))
+
+def print_stage_report(stages, timings):
+    """Печатает время этапов и критический путь"""
+    if not timings:
+        return
+    wall = max(end for _, end in timings.values()) - min(start for start, _ in timings.values())
+    total = sum(end - start for start, end in timings.values())
+    duration, path = critical_path(stages, timings)
+
+    log("\n⏱ Этапы сборки:")
+    for name, (start, end) in sorted(timings.items(), key=lambda item: item[1][0]):
+        log(f"  • {name}: {(end - start) * 1000:.0f} мс")
+    log(f"  Критический путь: {' → '.join(path)} ({duration * 1000:.0f} мс)")
+    log(f"  Общее время: {wall * 1000:.0f} мс (последовательно было бы {total * 1000:.0f} мс)")
+
+def generate_ttf_data(font):
+    """Генерирует TTF в памяти (файл создается только во временном каталоге) без меток времени"""
+    with scratch_dir() as tmp:
+        # FontForge определяет формат по расширению файла
+        ttf_file = os.path.join(tmp, 'font.ttf')
+        # Таблица FFTM содержит только даты сборки
+        font.generate(ttf_file, flags=('no-FFTM-table',))
+        with open(ttf_file, 'rb') as f:
+            return deterministic_ttf(f.read())
+
+def font_file_name(output_base, ext, data, hashed=None):
+    """Имя файла шрифта; с --hashed-names (или hashed=True) в него входит хэш содержимого"""
+    if FILE_NAMING['hashed'] if hashed is None else hashed:
+        return f"{output_base}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}.{ext}"
+    return f"{output_base}.{ext}"
+
+def font_file_stages(font, output_base, woff_converter, woff2_converter, cache_dir=CACHE_DIR, output_dir='.',
+                     max_compression=False):
+    """Этапы генерации файлов шрифта: TTF в памяти → WOFF и WOFF2 параллельно
+
+    Этап fonts возвращает созданные файлы {расширение: путь}.
+    """
+    hashed = FILE_NAMING['hashed']
+    # Новый конвертер (или появившийся формат) и смена режима сжатия делают прошлые файлы устаревшими
+    converters = {'woff': woff_converter, 'woff2': woff2_converter}
+
+    def generate_ttf(results):
+        log("\n=== Генерация файлов шрифта ===")
+        try:
+            # Генерируем TTF
+            ttf_data = generate_ttf_data(font)
+            log(f"✓ Создан TTF в памяти ({len(ttf_data) / 1024:.1f} KB)")
+        except Exception as e:
+            raise RuntimeError(f"Ошибка создания TTF: {e}")
+
+        # Если TTF не изменился с прошлой сборки, WOFF/WOFF2 пересобирать не нужно
+        state = load_build_state(cache_dir, output_base)
+        try:
+            ttf_hash = ttf_digest(ttf_data)
+        except Exception as e:
+            log(f"⚠ Не удалось вычислить хэш TTF: {e}")
+            ttf_hash = None
+
+        fresh = (bool(ttf_hash) and state.get('hashed', False) == hashed and
+                 state.get('converters') == converters and state.get('max_compression', False) == max_compression and
+                 state.get('output_dir') == os.path.abspath(output_dir) and outputs_up_to_date(state, ttf_hash))
+        if fresh:
+            log("✓ TTF не изменился, WOFF/WOFF2 актуальны — конвертация пропущена")
+        return {
+            'data': ttf_data,
+            'hash': ttf_hash,
+            'fresh': fresh,
+            'files': state.get('files', {}) if fresh else {},
+        }
+
+    def make_font_file(convert, converter, ext, label):
+        def stage(results):
+            ttf = results['ttf']
+            if ttf['fresh']:
+                return ttf['files'].get(ext)
+            if max_compression:
+                data = compress_tournament(ttf['data'], ext, cache_dir)
+            else:
+                data = convert(ttf['data'], converter)
+            if data is None:
+                return None
+            path = os.path.join(output_dir, font_file_name(output_base, ext, data))
+            write_atomic(path, data)
+            log(f"✓ Создан {label}: {path} ({len(data) / 1024:.1f} KB)")
+            return path
+        return stage
+
+    def save_state(results):
+        ttf = results['ttf']
+        files = {ext: results[ext] for ext in ('woff', 'woff2') if results[ext]}
+        if ttf['hash'] and not ttf['fresh']:
+            outputs = {path: file_digest(path) for path in files.values() if os.path.exists(path)}
+            store_build_state(cache_dir, output_base, {
+                'ttf': ttf['hash'], 'outputs': outputs, 'files': files,
+                'hashed': hashed, 'converters': converters, 'max_compression': max_compression,
+                'output_dir': os.path.abspath(output_dir),
+            })
+        return files
+
+    return {
+        'ttf': ((), generate_ttf),
+        'woff': (('ttf',), make_font_file(convert_to_woff, woff_converter, 'woff', 'WOFF')),
+        'woff2': (('ttf',), make_font_file(convert_to_woff2, woff2_converter, 'woff2', 'WOFF2')),
+        'fonts': (('woff', 'woff2'), save_state),
+    }
+
+def new_font(settings):
+    """Создает пустой шрифт с метриками из настроек"""
+    fontforge = load_fontforge()
+    font = fontforge.font()
+
+    # Важные метрики
+    font.em = settings['em']
+    font.ascent = settings['ascent']
+    font.descent = settings['descent']
+
+    # Очищаем все глифы
+    font.selection.all()
+    font.clear()
+    return font
+
+def reset_worker_output(trace=False):
+    """В процессе-воркере журнал родителя не используется, а события копятся локально"""
+    OUTPUT['jsonl'] = None
+    OUTPUT['trace'] = [] if trace else None
+
+def import_glyph_shard(items, settings, trace=False, cache_dir=CACHE_DIR):
+    """Воркер: импортирует часть SVG во временный шрифт и возвращает контуры и события трассы"""
+    reset_worker_output(trace)
+    font = new_font(settings)
+    if settings.get('batch_ops'):
+        results = [(char, dict(glyph_outline_data(font.createChar(ord(char))), report=report) if not error else None,
+                    error) for char, report, error in process_glyphs_batch(font, items, settings, cache_dir)]
+        font.close()
+        return results, OUTPUT['trace'] or []
+    results = []
+    for char, svg_path in items:
+        try:
+            with span('glyph', char=char, svg=os.path.basename(svg_path)):
+                glyph = font.createChar(ord(char))
+                report = process_glyph(glyph, svg_path, settings, cache_dir)
+            results.append((char, dict(glyph_outline_data(glyph), report=report), None))
+        except Exception as e:
+            results.append((char, None, str(e)))
+    font.close()
+    return results, OUTPUT['trace'] or []
+
+def import_glyphs_parallel(items, settings, jobs, cache_dir=CACHE_DIR):
+    """Импортирует SVG в пуле процессов, возвращает (символ, контуры, ошибка)"""
+    from concurrent.futures import ProcessPoolExecutor
+    # Мелкие части выравнивают нагрузку между процессами
+    shard_size = max(1, min(64, len(items) // (jobs * 4)))
+    shards = [items[i:i + shard_size] for i in range(0, len(items), shard_size)]
+
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for shard_results, events in pool.map(import_glyph_shard, shards, [settings] * len(shards),
+                                              [tracing()] * len(shards), [cache_dir] * len(shards)):
+            results.extend(shard_results)
+            for event in events:
+                emit(event)
+    return results
+
+# Оценка размера в TTF: заголовок глифа в glyf, записи в loca, hmtx и post; одна ссылка в составном глифе
+GLYPH_OVERHEAD = 18
+REFERENCE_SIZE = 8
+
+def new_glyph_bytes(name):
+    """Оценка размера нового безымянного глифа: заголовок, метрики и имя в таблице post"""
+    return GLYPH_OVERHEAD + len(name) + 1
+
+def contour_bytes(points):
+    """Оценка размера одного контура в glyf без заголовка глифа и длины инструкций"""
+    return estimate_glyf_bytes([points]) - 12
+
+# Точность ключа при точном сравнении координат (отбрасывает только шум плавающей точки)
+COORDINATE_DIGITS = 6
+# Длина префикса контура в ключе поиска с допуском: соседние ячейки перебираются только для него
+TOLERANCE_KEY_POINTS = 4
+
+def contour_classes(outlines, tolerance):
+    """Разбивает контуры глифов на классы совпадающих с точностью до сдвига
+
+    Без допуска контуры ищутся по словарю с ключом из относительных координат.
+    С допуском ключом служат ячейки сетки шагом 4·tolerance для первых точек
+    контура: совпадающий контур может лежать только в соседних ячейках, и
+    полная поточечная проверка выполняется лишь для найденных в них.
+    Возвращает {символ: [(класс, сдвиг), ...]} в порядке контуров глифа.
+    """
+    shapes = {}
+    cells = {}
+    count = 0
+    classes = {}
+    for char, data in outlines.items():
+        classes[char] = []
+        for contour in data['contours']:
+            points = contour['points']
+            x0, y0 = points[0][0], points[0][1]
+            relative = [(x - x0, y - y0) for x, y, on_curve in points]
+            kind = (contour['closed'], tuple(bool(p[2]) for p in points))
+            if not tolerance:
+                key = (kind, tuple((round(x, COORDINATE_DIGITS), round(y, COORDINATE_DIGITS)) for x, y in relative))
+                index = shapes.setdefault(key, count)
+                count += index == count
+                classes[char].append((index, (x0, y0)))
+                continue
+
+            step = 4 * tolerance
+            prefix = [value for point in relative[:TOLERANCE_KEY_POINTS] for value in point]
+            # Ячейки, в которых может лежать значение, отличающееся не больше чем на tolerance
+            options = [sorted({math.floor((value - tolerance) / step), math.floor((value + tolerance) / step)})
+                       for value in prefix]
+            index = None
+            for key in itertools.product(*options):
+                for candidate, shape in cells.get((kind, key), ()):
+                    if all(abs(x - sx) <= tolerance and abs(y - sy) <= tolerance
+                           for (x, y), (sx, sy) in zip(relative, shape)):
+                        index = candidate
+                        break
+                if index is not None:
+                    break
+            if index is None:
+                index = count
+                count += 1
+                own = tuple(math.floor(value / step) for value in prefix)
+                cells.setdefault((kind, own), []).append((index, relative))
+            classes[char].append((index, (x0, y0)))
+    return classes
+
+def offset_key(x, y, tolerance):
+    """Ключ положения контура: точный или с округлением до шага tolerance"""
+    if not tolerance:
+        return round(x, COORDINATE_DIGITS), round(y, COORDINATE_DIGITS)
+    return round(x / tolerance), round(y / tolerance)
+
+def dedupe_glyphs(font, created_glyphs, tolerance=0):
+    """Заменяет одинаковые глифы и общие части контуров составными ссылками
+
+    Точные копии (с допуском tolerance) ссылаются на первый глиф, контуры,
+    повторяющиеся в нескольких глифах, выносятся в отдельные компоненты.
+    В TrueType глиф не может одновременно содержать контуры и ссылки,
+    поэтому оставшиеся контуры такого глифа тоже становятся компонентом.
+    Возвращает оценку сэкономленных байт.
+    """
+    glyphs = {char: font.createChar(ord(char)) for char in sorted(created_glyphs, key=ord)}
+    outlines = {char: glyph_outline_data(glyph) for char, glyph in glyphs.items()}
+    outlines = {char: data for char, data in outlines.items() if data['contours']}
+    classes = contour_classes(outlines, tolerance)
+
+    def glyph_bytes(char):
+        return sum(contour_bytes(contour['points']) for contour in outlines[char]['contours'])
+
+    # Точные копии: те же классы контуров на тех же местах и та же ширина
+    saved = 0
+    originals = {}
+    duplicates = {}
+    for char, data in outlines.items():
+        signature = (data['width'], tuple((index, offset_key(x, y, tolerance)) for index, (x, y) in classes[char]))
+        if signature in originals:
+            duplicates[char] = originals[signature]
+            saved += glyph_bytes(char) - REFERENCE_SIZE
+        else:
+            originals[signature] = char
+    for char, original in duplicates.items():
+        glyph = glyphs[char]
+        glyph.clear()
+        glyph.addReference(glyphs[original].glyphname)
+        glyph.width = outlines[char]['width']
+
+    # Общие части: классы, встречающиеся в нескольких глифах, группируются в компоненты
+    # по набору глифов и взаимному расположению (например, рамка документа file-*)
+    occurrences = {}
+    for char in outlines:
+        if char in duplicates:
+            continue
+        for position, (index, offset) in enumerate(classes[char]):
+            occurrences.setdefault(index, {}).setdefault(char, (position, offset))
+    components = {}
+    for index, places in occurrences.items():
+        if len(places) < 2:
+            continue
+        chars = tuple(places)
+        base = places[chars[0]][1]
+        shifts = {char: (offset[0] - base[0], offset[1] - base[1]) for char, (position, offset) in places.items()}
+        key = (chars, tuple(offset_key(*shifts[char], tolerance) for char in chars))
+        component = components.setdefault(key, {'chars': chars, 'shifts': shifts, 'contours': []})
+        component['contours'].append({char: position for char, (position, offset) in places.items()})
+    components = list(components.values())
+
+    # Компонент выгоден, если контуры, удаляемые из глифов, больше него самого и ссылок на него;
+    # глиф, впервые получающий ссылки, дополнительно платит за компонент с оставшимися контурами
+    def component_benefit(component, name):
+        first = component['chars'][0]
+        size = sum(contour_bytes(outlines[first]['contours'][positions[first]]['points'])
+                   for positions in component['contours'])
+        return (len(component['chars']) - 1) * size - new_glyph_bytes(name) - REFERENCE_SIZE * len(component['chars'])
+
+    profitable = []
+    split = set()
+    for component in sorted(components, key=lambda item: -component_benefit(item, '_p0')):
+        name = f"_p{len(profitable) + 1}"
+        rest_cost = sum(new_glyph_bytes(f"_r{ord(char):X}") + REFERENCE_SIZE
+                        for char in component['chars'] if char not in split)
+        benefit = component_benefit(component, name) - rest_cost
+        if benefit > 0:
+            component['name'] = name
+            profitable.append(component)
+            split.update(component['chars'])
+            saved += benefit
+
+    factored = {}
+    for component in profitable:
+        first = component['chars'][0]
+        name = component['name']
+        part = font.createChar(-1, name)
+        apply_outline_data(part, dict(outlines[first], width=0, contours=[
+            outlines[first]['contours'][positions[first]] for positions in component['contours']]))
+        for char in component['chars']:
+            removed = {positions[char] for positions in component['contours']}
+            shift = tuple(round(value) for value in component['shifts'][char])
+            factored.setdefault(char, {'removed': set(), 'references': []})
+            factored[char]['removed'] |= removed
+            factored[char]['references'].append((name, (1, 0, 0, 1) + shift))
+
+    for char, parts in factored.items():
+        data = outlines[char]
+        glyph = glyphs[char]
+        rest = [contour for position, contour in enumerate(data['contours']) if position not in parts['removed']]
+        glyph.clear()
+        if rest:
+            remainder = font.createChar(-1, f"_r{ord(char):X}")
+            apply_outline_data(remainder, dict(data, width=0, contours=rest))
+            glyph.addReference(remainder.glyphname)
+        for name, matrix in parts['references']:
+            glyph.addReference(name, matrix)
+        glyph.width = data['width']
+
+    log(f"♻ Дедупликация: {len(duplicates)} копий глифов, {len(profitable)} общих частей "
+        f"в {len(factored)} глифах, экономия ≈{saved} байт TTF до сжатия")
+    return saved
+
+def build_font(svg_dir, output_base, mapping, cache_dir=CACHE_DIR, jobs=1, settings=GLYPH_SETTINGS, report=False):
+    """Создает шрифт fontforge из SVG файлов, возвращает (шрифт, созданные глифы)"""
     
     # Создаем новый шрифт
-    font = fontforge.font()
+    font = new_font(settings)
 
     # Устанавливаем метаданные
     font.fontname = output_base.replace(".", "")
     font.familyname = "ProTo"
     font.fullname = "ProTo Icon Font"
     font.version = "1.0"
+    # По умолчанию FontForge записывает в name ID 3 текущую дату — берем ту же, что и в head
+    build_date = time.strftime('%d-%m-%Y', time.gmtime(build_timestamp()))
+    font.appendSFNTName('English (US)', 'UniqueID', f"{font.fullname} : {build_date}")
 
-    # Важные метрики
-    font.em = 1000
-    font.ascent = 750
-    font.descent = 250
-
-    # Очищаем все глифы
-    font.selection.all()
-    font.clear()
-
-    print("\n=== Создание шрифта с иконками ProTo ===")
-    print(f"📁 Директория с SVG: {svg_dir}")
-    print(f"📦 Имя шрифта: {output_base}")
-    print("-" * 50)
+    log("\n=== Создание шрифта с иконками ProTo ===")
+    log(f"📁 Директория с SVG: {svg_dir}")
+    log(f"📦 Имя шрифта: {output_base}")
+    log("-" * 50)
 
     # Словарь для отслеживания созданных глифов
     created_glyphs = {}
     errors = []
     missing_files = []
+    cache_hits = 0
 
     # Проверяем наличие всех SVG файлов
-    print("\n🔍 Поиск SVG файлов...")
+    log("\n🔍 Поиск SVG файлов...")
     for char, svg_file in mapping.items():
         svg_path = os.path.join(svg_dir, svg_file)
         if not os.path.exists(svg_path):
             missing_files.append(svg_file)
     
     if missing_files:
-        print(f"⚠ Отсутствуют {len(missing_files)} SVG файлов:")
+        log(f"⚠ Отсутствуют {len(missing_files)} SVG файлов:")
         for f in missing_files[:5]:
-            print(f"  • {f}")
+            log(f"  • {f}")
         if len(missing_files) > 5:
-            print(f"  • и еще {len(missing_files) - 5}...")
+            log(f"  • и еще {len(missing_files) - 5}...")
     
-    print("\n🔨 Создание глифов:")
+    log("\n🔨 Создание глифов:")
     
-    # Создаем глифы
+    # Отбираем глифы для создания и ищем обработанные контуры в кэше
+    pending = []
+    outlines = {}
+    misses = {}
     for char, svg_file in mapping.items():
         if len(char) != 1:
             continue
 
         # Проверяем, не создан ли уже глиф для этого символа
         if char in created_glyphs:
-            print(f"⚠ Предупреждение: символ '{char}' уже создан из {created_glyphs[char]}, пропускаем {svg_file}")
+            log(f"⚠ Предупреждение: символ '{char}' уже создан из {created_glyphs[char]}, пропускаем {svg_file}")
             continue
 
         svg_path = os.path.join(svg_dir, svg_file)
@@ -287,255 +1805,1094 @@ def create_font_with_mapping(svg_dir, output_base, mapping, woff_converter, woff
             errors.append(f"Файл не найден: {svg_file} для символа '{char}'")
             continue
 
+        key = glyph_cache_key(svg_path, settings)
+        cached = load_cached_glyph(cache_dir, key)
+        if cached:
+            outlines[char] = cached
+            cache_hits += 1
+        else:
+            misses[char] = (svg_path, key)
+        pending.append((char, svg_file))
+
+    # В параллельном режиме недостающие SVG импортируются в пуле процессов,
+    # а сюда возвращаются уже обработанные контуры
+    imported = set()
+    parallel = jobs > 1 and len(misses) > 1
+    if parallel:
+        log(f"⚙ Параллельный импорт {len(misses)} SVG в {jobs} процессах")
+        items = [(char, svg_path) for char, (svg_path, key) in misses.items()]
+        for char, data, error in import_glyphs_parallel(items, settings, jobs, cache_dir):
+            if error:
+                errors.append(f"Ошибка импорта {mapping[char]}: {error}")
+                continue
+            outlines[char] = data
+            imported.add(char)
+            store_cached_glyph(cache_dir, misses[char][1], data)
+    
+    # В пакетном режиме недостающие глифы импортируются сразу в шрифт и оптимизируются вместе
+    batched = {}
+    batch = bool(settings.get('batch_ops')) and not parallel and bool(misses)
+    if batch:
+        log(f"⚙ Пакетная обработка {len(misses)} SVG")
+        items = [(char, svg_path) for char, (svg_path, key) in misses.items()]
+        for char, glyph_report, error in process_glyphs_batch(font, items, settings, cache_dir):
+            if error:
+                font.removeGlyph(font.createChar(ord(char)))
+                errors.append(f"Ошибка импорта {mapping[char]}: {error}")
+                continue
+            batched[char] = glyph_report
+            store_cached_glyph(cache_dir, misses[char][1],
+                               dict(glyph_outline_data(font.createChar(ord(char))), report=glyph_report))
+
+    # Создаем глифы; на больших наборах построчный вывод сам по себе заметно замедляет сборку
+    reports = {}
+    show_glyphs = OUTPUT['verbose'] or len(pending) <= GLYPH_LOG_LIMIT
+    for char, svg_file in pending:
+        if (parallel or batch) and char not in outlines and char not in batched:
+            continue
+
         try:
             unicode_val = ord(char)
-            glyph = font.createChar(unicode_val)
+            with span('glyph', char=char, svg=svg_file, cached=char in outlines):
+                glyph = font.createChar(unicode_val)
+                
+                if char in outlines:
+                    apply_outline_data(glyph, outlines[char])
+                    glyph_report = outlines[char].get('report')
+                elif char in batched:
+                    glyph_report = batched[char]
+                else:
+                    # Импортируем SVG и оптимизируем
+                    svg_path, key = misses[char]
+                    glyph_report = process_glyph(glyph, svg_path, settings, cache_dir)
+                    store_cached_glyph(cache_dir, key, dict(glyph_outline_data(glyph), report=glyph_report))
+            if glyph_report:
+                reports[char] = glyph_report
             
-            # Импортируем SVG
-            glyph.importOutlines(svg_path)
-            
-            # Вычисляем ширину
-            bbox = glyph.boundingBox()
-            if bbox and len(bbox) >= 4:
-                glyph.width = int(bbox[2]) + 50
-            else:
-                glyph.width = 600
-            
-            # Оптимизируем
-            glyph.simplify()
-            glyph.round()
-            
-            print(f"  ✓ {char} (U+{unicode_val:04X}) ← {svg_file}")
+            if show_glyphs:
+                source = ' (кэш)' if char in outlines and char not in imported else ''
+                log(f"  ✓ {char} (U+{unicode_val:04X}) ← {svg_file}{source}")
             created_glyphs[char] = svg_file
             
         except Exception as e:
             errors.append(f"Ошибка импорта {svg_file}: {e}")
 
-    print("\n" + "=" * 50)
-    print(f"✅ Создано глифов: {len(created_glyphs)}")
+    log("\n" + "=" * 50)
+    log(f"✅ Создано глифов: {len(created_glyphs)}")
+    if cache_hits:
+        log(f"♻ Из кэша: {cache_hits}")
     if errors:
-        print(f"⚠ Ошибок: {len(errors)}")
+        log(f"⚠ Ошибок: {len(errors)}")
         for error in errors[:5]:
-            print(f"  • {error}")
-    print("=" * 50)
+            log(f"  • {error}")
+    log("=" * 50)
 
-    if len(created_glyphs) == 0:
-        print("❌ Не создано ни одного глифа!")
+    if settings.get('dedupe') and created_glyphs:
+        dedupe_glyphs(font, created_glyphs, settings['dedupe_tolerance'])
+
+    if report:
+        print_optimization_report(reports, mapping)
+
+    return font, created_glyphs
+
+def write_output_manifest(output_base, output_dir, fonts):
+    """Манифест {логическое имя: файл} для имен с хэшем содержимого"""
+    manifest = {f"{output_base}.{ext}": os.path.basename(path) for ext, path in sorted(fonts.items())}
+    for name in (f"{output_base}.css", f"{output_base}.icons.css", f"{output_base}.inline.css",
+                 f"{output_base}.sprite.svg", f"{output_base}.preload.html", f"{output_base}.html",
+                 f"{output_base}.glyphs.json"):
+        if os.path.exists(os.path.join(output_dir, name)):
+            manifest[name] = name
+    manifest_file = os.path.join(output_dir, f"{output_base}.manifest.json")
+    write_atomic(manifest_file, json.dumps(manifest, indent=2) + "\n")
+    log(f"✓ Создан манифест: {manifest_file}")
+
+# Версия манифеста глифов ProTo.glyphs.json (--css-only, --html-only)
+GLYPH_MANIFEST_VERSION = 1
+
+def write_glyph_manifest(output_base, output_dir, created_glyphs, fonts=None, chunks=None, em=None):
+    """Сохраняет созданные глифы и имена файлов шрифта: по ним CSS и демо
+    пересобираются без fontforge и конвертеров"""
+    manifest = {
+        'version': GLYPH_MANIFEST_VERSION,
+        'font': output_base,
+        'family': 'ProTo',
+        'em': em,
+        'hashed': FILE_NAMING['hashed'],
+        'fonts': {ext: os.path.basename(path) for ext, path in sorted((fonts or {}).items()) if path},
+        'chunks': [list(chunk) for chunk in chunks] if chunks else None,
+        'glyphs': [{'char': char, 'codepoint': f"U+{ord(char):04X}", 'svg': svg_file}
+                   for char, svg_file in created_glyphs.items()],
+    }
+    manifest_file = os.path.join(output_dir, f"{output_base}.glyphs.json")
+    write_atomic(manifest_file, json.dumps(manifest, ensure_ascii=False, indent=2) + "\n")
+    log(f"✓ Создан манифест глифов: {manifest_file}")
+
+def load_glyph_manifest(output_base, output_dir):
+    """Читает манифест глифов: (созданные глифы, файлы шрифта или None, части шрифта или None)"""
+    with open(os.path.join(output_dir, f"{output_base}.glyphs.json"), encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != GLYPH_MANIFEST_VERSION:
+        raise ValueError(f"неподдерживаемая версия {manifest.get('version')}")
+    created_glyphs = {glyph['char']: glyph['svg'] for glyph in manifest['glyphs']}
+    # Без хэшей CSS ссылается на имена по умолчанию, как и при полной сборке
+    fonts = manifest['fonts'] if manifest.get('hashed') else None
+    chunks = [tuple(chunk) for chunk in manifest['chunks']] if manifest.get('chunks') else None
+    return created_glyphs, fonts, chunks
+
+def regenerate_from_manifest(output_base, output_dir, css=True, html=True):
+    """Пересобирает CSS и/или HTML демо по манифесту глифов, не запуская fontforge"""
+    started = time.perf_counter()
+    manifest_file = os.path.join(output_dir, f"{output_base}.glyphs.json")
+    try:
+        created_glyphs, fonts, chunks = load_glyph_manifest(output_base, output_dir)
+    except FileNotFoundError:
+        log(f"❌ Нет манифеста глифов {manifest_file}: сначала соберите шрифт")
+        return False
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        log(f"❌ Не удалось прочитать манифест глифов {manifest_file}: {e}")
         return False
 
-    # Генерируем файлы
-    success = generate_font_files(font, output_base, created_glyphs, woff_converter, woff2_converter)
+    if chunks:
+        # Части шрифта загружаются по требованию и не предзагружаются
+        fonts = {}
+    if css:
+        create_css_file(output_base, created_glyphs, output_dir, fonts, chunks)
+    if html:
+        create_html_demo(output_base, created_glyphs, output_dir, fonts)
+    log(f"⏱ {len(created_glyphs)} глифов из манифеста, {(time.perf_counter() - started) * 1000:.0f} мс")
+    return True
+
+def write_artifacts(font, output_base, created_glyphs, woff_converter, woff2_converter, cache_dir=CACHE_DIR,
+                    output_dir='.', max_compression=False, stats=None, files=None, svg_dir=None):
+    """Генерирует файлы шрифта, CSS и HTML из готового шрифта
+
+    Если передан словарь stats, в него записывается длительность этапов,
+    а в словарь files — созданные файлы шрифта {расширение: путь}. Для
+    SVG-спрайта нужна директория с исходными SVG (svg_dir).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    stages = font_file_stages(font, output_base, woff_converter, woff2_converter, cache_dir, output_dir,
+                              max_compression)
+    if FILE_NAMING['hashed']:
+        # Имена файлов шрифта известны только после конвертации
+        stages['css'] = (('fonts',), lambda results: create_css_file(output_base, created_glyphs, output_dir,
+                                                                      results['fonts']))
+        stages['html'] = (('fonts',), lambda results: create_html_demo(output_base, created_glyphs, output_dir,
+                                                                        results['fonts']))
+    else:
+        # CSS и HTML не зависят от конвертации и пишутся, пока работают конвертеры
+        stages['css'] = ((), lambda results: create_css_file(output_base, created_glyphs, output_dir))
+        stages['html'] = ((), lambda results: create_html_demo(output_base, created_glyphs, output_dir))
+    if TARGETS['inline_css']:
+        stages['inline'] = (('fonts',), lambda results: create_inline_css(output_base, created_glyphs,
+                                                                           results['fonts'].get('woff2'), output_dir))
+    if TARGETS['sprite'] and svg_dir:
+        stages['sprite'] = ((), lambda results: create_svg_sprite(output_base, created_glyphs, svg_dir, output_dir,
+                                                                   font.em))
+    if SIZE_BUDGET['report'] or SIZE_BUDGET['glyph'] is not None or SIZE_BUDGET['total'] is not None:
+        stages['sizes'] = (('ttf', 'fonts'), lambda results: report_glyph_sizes(results['ttf']['data'], created_glyphs,
+                                                                                results['fonts'].get('woff2')))
+    stages['glyphs'] = (('fonts',), lambda results: write_glyph_manifest(output_base, output_dir, created_glyphs,
+                                                                          results['fonts'], em=font.em))
+    if FILE_NAMING['hashed']:
+        deps = tuple(name for name in ('css', 'html', 'inline', 'sprite', 'glyphs') if name in stages)
+        stages['manifest'] = (deps, lambda results: write_output_manifest(output_base, output_dir,
+                                                                           results['fonts']))
+    results, timings = run_stages(stages)
+    success = bool(results.get('fonts')) and results.get('sizes') is not False
+    if files is not None:
+        files.update(results.get('fonts') or {})
+    if TARGETS['inline_css'] or TARGETS['sprite']:
+        print_size_report(output_base, output_dir, results.get('fonts') or {})
     
     if success:
-        # Создаем CSS и HTML
-        create_css_file(output_base, created_glyphs)
-        create_html_demo(output_base, created_glyphs)
-        print(f"\n✅ Готово! Файлы сохранены в текущей директории")
-    
-    return True
+        log(f"\n✅ Готово! Файлы сохранены в {os.path.abspath(output_dir)}")
+    elif results.get('fonts'):
+        log("\n❌ Превышен бюджет размера шрифта")
+    else:
+        log("\n❌ Не удалось создать ни WOFF, ни WOFF2")
+    print_stage_report(stages, timings)
+    if stats is not None:
+        stats.update({name: end - start for name, (start, end) in timings.items()})
+    return success
 
-def create_css_file(output_base, created_glyphs):
-    """Создание CSS файла"""
-    
-    css_content = f"""
-@font-face {{
-    font-family: 'ProTo';
-    src: url('{output_base}.woff2') format('woff2'),
-         url('{output_base}.woff') format('woff');
-}}
-
-.icons *:before, .icons *:after,.icon *:before, .icon *:after {{
-    font-family: ProTo;
-    text-transform: none;
-    font-variant: normal;
-    font-weight: normal;
-    font-style: normal;
-    margin-right: .2em;
-    overflow-wrap: anywhere;
-    text-decoration: none;
-    display: inline-block;
-  }}
-
-  a:is([href*="https://youtube.com"], [href*="https://youtu.be"]):before {{
-    content: 'Y';
-    color: #B02C27;
-  }}
-  a:is([href*="https://vk.com"], [href*="https://vk.ru"], [href*="https://vkvideo.ru"]):before {{
-    content:'V';
-    color:#4C75A3;
-  }}
-  a[href*="https://rutube.ru"]:before {{
-    content:'R';
-    color:#0b253c;
-  }}
-  a[href*="https://max.ru"]:before {{
-    content:'M';
-    color:#5f80f5;
-  }}
-  a[href*="https://t.me"]:before {{
-    content:'T';
-    color: #23a0dc;
-  }}
-  a[href*="https://ok.ru"]:before {{
-    content:'O';
-    color: #ee8208;
-  }}
-  a[href*="https://wa.me"]:before {{
-    content: '(';
-    color: #23ce47;
-  }}
-  a[href*="viber:"]:before {{
-    content: ')';
-    color: #793baa;
-  }}
-  a[href$=".pdf"]:before {{
-    content: "p";
-    color: red;
-  }}
-  a:is([href$=".doc"], [href$=".docx"]):before {{
-    content: "w";
-    color: #1962b3;
-  }}
-  a:is([href$=".xls"], [href$=".xlsx"]):before {{
-    content: "x";
-    color: #0f8a42;
-  }}
-  a:is([href$=".zip"],[href$=".rar"], [href$=".7zip"]):before {{
-    content: "z";
-  }}
-  a[href^="mailto:"]:before {{
-    content: "m";
-  }}
-  a[href^="tel:"]:before {{
-    content: "t";
-  }}
-  a:is([href^="mailto:"], [href^="tel:"]) {{
-    white-space: nowrap;
-    max-width: 99%;
-    overflow: hidden;
-    text-overflow: ellipsis;
-    display: inline-block;
-  }}
-  .fax:before {{
-    content: '*' !important;
-    margin-right: 4px !important;
-  }}
-  .text:before {{
-    content: 'D' !important;
-  }}
-   a.link:after, .links a:after {{
-    content: 'u' !important;
-    margin-left: 4px !important;
-    color: #a2a2a2;
-  }}
-  .people:before {{
-    content: 'P' !important;
-  }}
-  .location:before {{
-    content: "l";
-  }}
-  .rub:after {{
-    content: "r"; 
-  }}
-  .icon .find:before  {{
-    content: "f";
-  }}
-  .top:before  {{
-    content: "<";
-  }}
-   .bottom:before  {{
-    content: ">";
-  }}
-  .plus:before  {{
-    content: "+";
-  }}
-  .no-icon a:after, a.no-icon:after, .no-icon a:before, a.no-icon:before, .no-icon:after, .no-icon:before {{
-    content: none !important;
-  }}
-  @media (max-width: 769px) {{
-    a:is([href$=".zip"], [href$=".rar"],[href$=".7zip"],[href$=".xls"], [href$=".xlsx"], [href$=".pdf"], [href$=".doc"], [href$=".docx"], .location, .link) {{
-      overflow: hidden;
-    }}
-  }}
+def create_font_with_mapping(svg_dir, output_base, mapping, woff_converter, woff2_converter, cache_dir=CACHE_DIR, jobs=1,
+                             output_dir='.', settings=GLYPH_SETTINGS, report=False, max_compression=False):
+    """Создает шрифт из SVG файлов"""
+    font, created_glyphs = build_font(svg_dir, output_base, mapping, cache_dir, jobs, settings, report)
 
+    if len(created_glyphs) == 0:
+        log("❌ Не создано ни одного глифа!")
+        return False
 
-"""
+    # Генерируем файлы
+    return write_artifacts(font, output_base, created_glyphs, woff_converter, woff2_converter, cache_dir, output_dir,
+                           max_compression, svg_dir=svg_dir)
 
-    for char, svg_file in created_glyphs.items():
-        class_name = os.path.splitext(svg_file)[0].lower()
-        class_name = ''.join(c for c in class_name if c.isalnum() or c == '-')
-        
-        css_content += f"""
+# Области для частного использования (PUA): сначала BMP, затем плоскости 15 и 16
+PUA_RANGES = [(0xE000, 0xF8FF), (0xF0000, 0xFFFFD), (0x100000, 0x10FFFD)]
+# Файл с назначенными кодами в директории с SVG
+CODEPOINTS_FILE = "codepoints.json"
 
-"""
+def next_free_codepoint(codepoint, used):
+    """Первый свободный код PUA, начиная с codepoint"""
+    for start, end in PUA_RANGES:
+        codepoint = max(codepoint, start)
+        while codepoint <= end:
+            if codepoint not in used:
+                return codepoint
+            codepoint += 1
+    raise ValueError("Свободные коды в областях PUA закончились")
 
-    css_file = f"{output_base}.css"
-    with open(css_file, "w", encoding='utf-8') as f:
-        f.write(css_content)
-    
-    print(f"✓ Создан CSS: {css_file}")
+def load_codepoints(path):
+    """Назначенные ранее коды {SVG: код} из манифеста"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return {}
+    return {svg_file: int(value[2:], 16) for svg_file, value in manifest.get('glyphs', {}).items()}
+
+def allocate_codepoints(svg_dir, manifest_path=None):
+    """Сопоставление {символ PUA: SVG} для всех SVG директории
+
+    Коды хранятся в манифесте (по умолчанию codepoints.json в svg_dir):
+    иконки сохраняют свои коды между сборками, новые получают следующие
+    свободные, а коды удаленных иконок остаются занятыми и не переиспользуются.
+    """
+    manifest_path = manifest_path or os.path.join(svg_dir, CODEPOINTS_FILE)
+    codepoints = load_codepoints(manifest_path)
+    svg_files = sorted(os.path.basename(path) for path in glob.glob(os.path.join(svg_dir, '*.svg')))
+
+    used = set(codepoints.values())
+    codepoint = max(used) + 1 if used else PUA_RANGES[0][0]
+    added = [svg_file for svg_file in svg_files if svg_file not in codepoints]
+    for svg_file in added:
+        codepoint = next_free_codepoint(codepoint, used)
+        codepoints[svg_file] = codepoint
+        used.add(codepoint)
+
+    if added or not os.path.exists(manifest_path):
+        glyphs = {svg_file: f"U+{cp:04X}" for svg_file, cp in sorted(codepoints.items(), key=lambda item: item[1])}
+        write_atomic(manifest_path, json.dumps({'glyphs': glyphs}, indent=2, ensure_ascii=False) + "\n")
+        log(f"✓ Назначено новых кодов: {len(added)} ({manifest_path})")
+
+    return {chr(codepoints[svg_file]): svg_file
+            for svg_file in sorted(svg_files, key=codepoints.__getitem__)}
+
+def load_batch_manifest(manifest_path):
+    """Читает манифест пакетной сборки: список наборов (svg_dir, mapping, output)
+
+    Пути в манифесте указываются относительно файла манифеста. mapping —
+    словарь {символ: SVG}, путь к JSON с таким словарем или "auto" (коды PUA
+    из codepoints.json набора); если он не задан, используется icon_mapping.
+    """
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    sets = []
+    for entry in manifest.get('sets', []):
+        mapping = entry.get('mapping', icon_mapping)
+        if mapping == 'auto':
+            mapping = allocate_codepoints(os.path.join(base_dir, entry['svg_dir']))
+        elif isinstance(mapping, str):
+            with open(os.path.join(base_dir, mapping), encoding='utf-8') as f:
+                mapping = json.load(f)
+        sets.append({
+            'name': entry.get('output', 'ProTo'),
+            'svg_dir': os.path.join(base_dir, entry['svg_dir']),
+            'mapping': mapping,
+            'output_dir': os.path.join(base_dir, entry.get('output_dir', '.')),
+        })
+    return sets
+
+def output_options():
+    """Параметры оформления и проверок, заданные в командной строке, для передачи в процессы-воркеры"""
+    return {'css': dict(CSS_OPTIONS), 'naming': dict(FILE_NAMING), 'targets': dict(TARGETS),
+            'budget': dict(SIZE_BUDGET)}
 
-def create_html_demo(output_base, created_glyphs):
-    """Создание HTML демо"""
-   
+def apply_output_options(options):
+    """Воркер: восстанавливает параметры родителя — при spawn/forkserver глобальные
+    словари процесса-воркера содержат значения по умолчанию"""
+    if options is None:
+        return
+    CSS_OPTIONS.update(options['css'])
+    FILE_NAMING.update(options['naming'])
+    TARGETS.update(options['targets'])
+    SIZE_BUDGET.update(options['budget'])
+
+def build_icon_set(icon_set, woff_converter, woff2_converter, cache_dir=CACHE_DIR, settings=GLYPH_SETTINGS,
+                   options=None):
+    """Воркер пакетной сборки: собирает один набор, возвращает сводку"""
+    started = time.perf_counter()
+    captured = io.StringIO()
+    result = {'name': icon_set['name'], 'glyphs': 0, 'ok': False, 'sizes': {}, 'log': ''}
+    files = {}
+    reset_worker_output()
+    apply_output_options(options)
+    try:
+        # Вывод наборов, собираемых одновременно, перемешался бы — сохраняем его отдельно
+        with contextlib.redirect_stdout(captured):
+            font, created_glyphs = build_font(icon_set['svg_dir'], icon_set['name'], icon_set['mapping'], cache_dir,
+                                              settings=settings)
+            result['glyphs'] = len(created_glyphs)
+            if created_glyphs:
+                result['ok'] = write_artifacts(font, icon_set['name'], created_glyphs, woff_converter,
+                                               woff2_converter, cache_dir, icon_set['output_dir'], files=files,
+                                               svg_dir=icon_set['svg_dir'])
+            font.close()
+    except Exception as e:
+        captured.write(f"❌ {e}\n")
+
+    for ext, path in files.items():
+        if os.path.exists(path):
+            result['sizes'][ext] = os.path.getsize(path)
+    result['time'] = time.perf_counter() - started
+    result['log'] = captured.getvalue()
+    return result
+
+def build_batch(manifest_path, woff_converter, woff2_converter, cache_dir=CACHE_DIR, jobs=1, settings=GLYPH_SETTINGS):
+    """Собирает все наборы из манифеста в пуле процессов и печатает сводку"""
+    from concurrent.futures import ProcessPoolExecutor
+    sets = load_batch_manifest(manifest_path)
+    log(f"\n=== Пакетная сборка: {len(sets)} наборов, {jobs} процессов ===")
+
+    started = time.perf_counter()
+    results = []
+    options = output_options()
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(build_icon_set, icon_set, woff_converter, woff2_converter, cache_dir, settings, options)
+                   for icon_set in sets]
+        for future in futures:
+            result = future.result()
+            log(f"  {'✓' if result['ok'] else '❌'} {result['name']} ({result['time']:.1f} с)")
+            if not result['ok']:
+                log(result['log'])
+            results.append(result)
+
+    name_width = max([len(result['name']) for result in results] + [5])
+    log("\n" + "=" * (name_width + 40))
+    log(f"{'Набор':<{name_width}}  {'Глифов':>6}  {'Время, с':>8}  {'WOFF, KB':>8}  {'WOFF2, KB':>9}")
+    log("-" * (name_width + 40))
+    for result in results:
+        woff = f"{result['sizes']['woff'] / 1024:.1f}" if 'woff' in result['sizes'] else '—'
+        woff2 = f"{result['sizes']['woff2'] / 1024:.1f}" if 'woff2' in result['sizes'] else '—'
+        log(f"{result['name']:<{name_width}}  {result['glyphs']:>6}  {result['time']:>8.2f}  {woff:>8}  {woff2:>9}")
+    log("=" * (name_width + 40))
+    failed = sum(1 for result in results if not result['ok'])
+    log(f"Всего: {time.perf_counter() - started:.2f} с, ошибок: {failed}")
+    return failed == 0
+
+def svg_snapshot(svg_dir):
+    """Время изменения и размер каждого SVG в директории"""
+    snapshot = {}
+    for path in glob.glob(os.path.join(svg_dir, '*.svg')):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        snapshot[os.path.basename(path)] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+def watch_changes(svg_dir, interval=0.1):
+    """Генератор множеств измененных SVG: через inotify, иначе опросом"""
+    try:
+        import ctypes
+        import ctypes.util
+        import select
+
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = libc.inotify_init1(os.O_CLOEXEC)
+        # IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+        mask = 0x08 | 0x40 | 0x80 | 0x100 | 0x200
+        if fd < 0 or libc.inotify_add_watch(fd, os.fsencode(svg_dir), mask) < 0:
+            raise OSError(ctypes.get_errno(), "inotify недоступен")
+    except (OSError, AttributeError, TypeError):
+        log("⚠ inotify недоступен, используется опрос директории")
+        snapshot = svg_snapshot(svg_dir)
+        while True:
+            time.sleep(interval * 5)
+            current = svg_snapshot(svg_dir)
+            changed = {name for name in set(snapshot) | set(current) if snapshot.get(name) != current.get(name)}
+            snapshot = current
+            if changed:
+                yield changed
+
+    try:
+        while True:
+            changed = set()
+            select.select([fd], [], [])
+            # Редакторы сохраняют файл несколькими операциями: собираем их вместе
+            while select.select([fd], [], [], interval)[0]:
+                data = os.read(fd, 64 * 1024)
+                offset = 0
+                while offset < len(data):
+                    _, _, _, length = struct.unpack_from('iIII', data, offset)
+                    name = data[offset + 16:offset + 16 + length].rstrip(b'\0')
+                    offset += 16 + length
+                    name = os.fsdecode(name)
+                    if name.endswith('.svg'):
+                        changed.add(name)
+            if changed:
+                yield changed
+    finally:
+        os.close(fd)
+
+def reload_glyph(font, char, svg_path, cache_dir=CACHE_DIR, settings=GLYPH_SETTINGS):
+    """Заново импортирует один глиф в уже открытый шрифт"""
+    glyph = font.createChar(ord(char))
+    glyph.clear()
+
+    key = glyph_cache_key(svg_path, settings)
+    cached = load_cached_glyph(cache_dir, key)
+    if cached:
+        apply_outline_data(glyph, cached)
+        return
+    # Контуры обрабатываются тем же способом, что и при полной сборке: ключ кэша учитывает batch_ops
+    if settings.get('batch_ops'):
+        [(_, report, error)] = process_glyphs_batch(font, [(char, svg_path)], settings, cache_dir)
+        if error:
+            raise RuntimeError(error)
+    else:
+        report = process_glyph(glyph, svg_path, settings, cache_dir)
+    store_cached_glyph(cache_dir, key, dict(glyph_outline_data(glyph), report=report))
+
+def watch_font(svg_dir, output_base, mapping, woff_converter, woff2_converter, cache_dir=CACHE_DIR, jobs=1,
+               output_dir='.', settings=GLYPH_SETTINGS, auto=False, codepoints_file=None):
+    """Режим наблюдения: шрифт остается в памяти, при изменении SVG
+    переимпортируется только измененный глиф
+
+    С auto новые SVG получают коды PUA и добавляются в шрифт на лету.
+    """
+    font, created_glyphs = build_font(svg_dir, output_base, mapping, cache_dir, jobs, settings)
+    if created_glyphs:
+        write_artifacts(font, output_base, created_glyphs, woff_converter, woff2_converter, cache_dir, output_dir,
+                        svg_dir=svg_dir)
+
+    # Один SVG может быть назначен нескольким символам
+    chars_by_svg = {}
+    for char, svg_file in mapping.items():
+        if len(char) == 1:
+            chars_by_svg.setdefault(svg_file, []).append(char)
+
+    log(f"\n👀 Наблюдение за {svg_dir} (Ctrl+C — выход)")
+    try:
+        for changed in watch_changes(svg_dir):
+            started = time.perf_counter()
+            updated = 0
+            if auto and any(svg_file not in chars_by_svg and os.path.exists(os.path.join(svg_dir, svg_file))
+                            for svg_file in changed):
+                mapping = allocate_codepoints(svg_dir, codepoints_file)
+                for char, svg_file in mapping.items():
+                    chars_by_svg.setdefault(svg_file, [char])
+            for svg_file in sorted(changed):
+                svg_path = os.path.join(svg_dir, svg_file)
+                for char in chars_by_svg.get(svg_file, []):
+                    try:
+                        if os.path.exists(svg_path):
+                            reload_glyph(font, char, svg_path, cache_dir, settings)
+                            created_glyphs[char] = svg_file
+                            log(f"  ↻ {char} (U+{ord(char):04X}) ← {svg_file}")
+                        elif char in created_glyphs:
+                            font.removeGlyph(font.createChar(ord(char)))
+                            del created_glyphs[char]
+                            log(f"  ✗ {char} (U+{ord(char):04X}) — {svg_file} удален")
+                        updated += 1
+                    except Exception as e:
+                        log(f"⚠ Ошибка импорта {svg_file}: {e}")
+
+            if not updated:
+                continue
+            if settings.get('dedupe'):
+                # Глифы связаны ссылками на общие части: шрифт пересобирается из кэша глифов
+                font.close()
+                with quiet_output():
+                    font, created_glyphs = build_font(svg_dir, output_base, mapping, cache_dir, jobs, settings)
+            # Сохраняем порядок глифов как в сопоставлении
+            created_glyphs = {char: created_glyphs[char] for char in mapping if char in created_glyphs}
+            if created_glyphs:
+                write_artifacts(font, output_base, created_glyphs, woff_converter, woff2_converter, cache_dir,
+                                output_dir, svg_dir=svg_dir)
+            log(f"⏱ Обновлено за {(time.perf_counter() - started) * 1000:.0f} мс")
+    except KeyboardInterrupt:
+        log("\n👋 Наблюдение остановлено")
+
+# Оформление CSS (--minify-css, --split-css, --font-display)
+CSS_OPTIONS = {'minify': False, 'split': False, 'font_display': 'block'}
+
+# Правила CSS: (медиа-запрос, селекторы, объявления). Значение content
+# задается как (SVG, символ по умолчанию[, !important]) и берется из созданных глифов
+CSS_RULES = [
+    (None, ('.icons *:before', '.icons *:after', '.icon *:before', '.icon *:after'), [
+        ('font-family', 'ProTo'), ('text-transform', 'none'), ('font-variant', 'normal'),
+        ('font-weight', 'normal'), ('font-style', 'normal'), ('margin-right', '.2em'),
+        ('overflow-wrap', 'anywhere'), ('text-decoration', 'none'), ('display', 'inline-block')]),
+    (None, ('a:is([href*="https://youtube.com"], [href*="https://youtu.be"]):before',), [
+        ('content', ('youtube.svg', 'Y')), ('color', '#B02C27')]),
+    (None, ('a:is([href*="https://vk.com"], [href*="https://vk.ru"], [href*="https://vkvideo.ru"]):before',), [
+        ('content', ('vk.svg', 'V')), ('color', '#4C75A3')]),
+    (None, ('a[href*="https://rutube.ru"]:before',), [('content', ('rutube.svg', 'R')), ('color', '#0b253c')]),
+    (None, ('a[href*="https://max.ru"]:before',), [('content', ('max.svg', 'M')), ('color', '#5f80f5')]),
+    (None, ('a[href*="https://t.me"]:before',), [('content', ('telegram.svg', 'T')), ('color', '#23a0dc')]),
+    (None, ('a[href*="https://ok.ru"]:before',), [('content', ('ok.svg', 'O')), ('color', '#ee8208')]),
+    (None, ('a[href*="https://wa.me"]:before',), [('content', '"("'), ('color', '#23ce47')]),
+    (None, ('a[href*="viber:"]:before',), [('content', '")"'), ('color', '#793baa')]),
+    (None, ('a[href$=".pdf"]:before',), [('content', ('file-pdf.svg', 'p')), ('color', 'red')]),
+    (None, ('a:is([href$=".doc"], [href$=".docx"]):before',), [
+        ('content', ('file-word.svg', 'w')), ('color', '#1962b3')]),
+    (None, ('a:is([href$=".xls"], [href$=".xlsx"]):before',), [
+        ('content', ('file-xl.svg', 'x')), ('color', '#0f8a42')]),
+    (None, ('a:is([href$=".zip"],[href$=".rar"], [href$=".7zip"]):before',), [('content', ('file-zip.svg', 'z'))]),
+    (None, ('a[href^="mailto:"]:before',), [('content', ('mail.svg', 'm'))]),
+    (None, ('a[href^="tel:"]:before',), [('content', ('phone.svg', 't'))]),
+    (None, ('a:is([href^="mailto:"], [href^="tel:"])',), [
+        ('white-space', 'nowrap'), ('max-width', '99%'), ('overflow', 'hidden'),
+        ('text-overflow', 'ellipsis'), ('display', 'inline-block')]),
+    (None, ('.fax:before',), [('content', ('phone-fax.svg', '*', '!important')), ('margin-right', '4px !important')]),
+    (None, ('.text:before',), [('content', '"D" !important')]),
+    (None, ('a.link:after', '.links a:after'), [
+        ('content', ('link.svg', 'u', '!important')), ('margin-left', '4px !important'), ('color', '#a2a2a2')]),
+    (None, ('.people:before',), [('content', ('people.svg', 'P', '!important'))]),
+    (None, ('.location:before',), [('content', ('map.svg', 'l'))]),
+    (None, ('.rub:after',), [('content', ('rub.svg', 'r'))]),
+    (None, ('.icon .find:before',), [('content', ('find.svg', 'f'))]),
+    (None, ('.top:before',), [('content', ('arrow-dn.svg', '<'))]),
+    (None, ('.bottom:before',), [('content', ('arrow-up.svg', '>'))]),
+    (None, ('.plus:before',), [('content', ('close.svg', '+'))]),
+    (None, ('.no-icon a:after', 'a.no-icon:after', '.no-icon a:before', 'a.no-icon:before', '.no-icon:after',
+            '.no-icon:before'), [('content', 'none !important')]),
+    ('(max-width: 769px)', ('a:is([href$=".zip"], [href$=".rar"],[href$=".7zip"],[href$=".xls"], [href$=".xlsx"], '
+                            '[href$=".pdf"], [href$=".doc"], [href$=".docx"], .location, .link)',), [
+        ('overflow', 'hidden')]),
+]
+
+# Общие свойства классов отдельных иконок (.icon-<имя>)
+ICON_CLASS_SELECTORS = ('[class^="icon-"]:before', '[class*=" icon-"]:before')
+ICON_CLASS_DECLARATIONS = [('font-family', 'ProTo'), ('font-style', 'normal'), ('font-weight', 'normal'),
+                           ('font-variant', 'normal'), ('text-transform', 'none'), ('display', 'inline-block')]
+
+def css_string(text):
+    """Строка CSS в кавычках; символы вне ASCII экранируются (\\e001)"""
+    escaped = []
+    for i, char in enumerate(text):
+        if char in '"\\':
+            escaped.append('\\' + char)
+        elif 32 <= ord(char) < 127:
+            escaped.append(char)
+        else:
+            # Пробел завершает escape-последовательность, если дальше идет шестнадцатеричная цифра или пробел
+            tail = text[i + 1:i + 2]
+            separator = ' ' if tail and (tail in '0123456789abcdefABCDEF ') else ''
+            escaped.append(f"\\{ord(char):x}{separator}")
+    return '"' + ''.join(escaped) + '"'
+
+def icon_class(svg_file):
+    """Имя класса иконки из имени SVG: строчные буквы, цифры и дефис"""
+    name = os.path.splitext(svg_file)[0].lower()
+    return ''.join(c for c in name if c.isalnum() or c == '-')
 
-    # Генерируем классы для иконок прямо здесь
-    icon_classes = ""
+def css_selectors(selectors, minify=False):
+    """Селекторы без повторов; при минификации — без лишних пробелов"""
+    cleaned = []
+    for selector in selectors:
+        selector = re.sub(r'\s+', ' ', selector.strip())
+        if minify:
+            selector = re.sub(r'\s*,\s*', ',', selector)
+        cleaned.append(selector)
+    return list(dict.fromkeys(cleaned))
+
+def merge_css_rules(rules):
+    """Объединяет соседние правила с одинаковыми объявлениями (порядок каскада не меняется)"""
+    merged = []
+    for media, selectors, declarations in rules:
+        if merged and merged[-1][0] == media and merged[-1][2] == declarations:
+            merged[-1] = (media, merged[-1][1] + tuple(selectors), declarations)
+        else:
+            merged.append((media, tuple(selectors), declarations))
+    return merged
+
+def css_block(header, declarations, minify=False):
+    """Блок CSS: заголовок (селекторы или @-правило) и объявления"""
+    if minify:
+        return header + '{' + ';'.join(f"{name}:{value}" for name, value in declarations) + '}'
+    return header + ' {\n' + ''.join(f"    {name}: {value};\n" for name, value in declarations) + '}\n'
+
+def write_css_rules(f, rules, minify=False):
+    """Записывает правила в файл по одному, не собирая весь текст в памяти"""
+    for media, selectors, declarations in merge_css_rules(rules):
+        rule = css_block((',' if minify else ', ').join(css_selectors(selectors, minify)), declarations, minify)
+        if media:
+            rule = f"@media {media}{{{rule}}}" if minify else f"@media {media} {{\n{rule}}}\n"
+        f.write(rule)
+
+def css_font_face(font_files, font_display='block', unicode_range=None):
+    """Объявления @font-face; font_files — [(файл, формат)]"""
+    src = ', '.join(f"url('{font_file}') format('{fmt}')" for font_file, fmt in font_files)
+    declarations = [('font-family', "'ProTo'"), ('src', src), ('font-display', font_display)]
+    if unicode_range:
+        declarations.append(('unicode-range', unicode_range))
+    return declarations
+
+def unicode_range(chars):
+    """Значение unicode-range: коды символов, слитые в непрерывные диапазоны"""
+    spans = []
+    for codepoint in sorted(set(map(ord, chars))):
+        if spans and spans[-1][1] == codepoint - 1:
+            spans[-1][1] = codepoint
+        else:
+            spans.append([codepoint, codepoint])
+    return ', '.join(f"U+{start:X}" if start == end else f"U+{start:X}-{end:X}" for start, end in spans)
+
+def css_glyph_rules(created_glyphs):
+    """Правила основной таблицы с символами созданных глифов"""
+    # Символ каждой иконки по имени SVG: при автоматическом назначении кодов
+    # иконки получают коды PUA вместо букв из icon_mapping
+    chars_by_svg = {}
     for char, svg_file in created_glyphs.items():
-        class_name = os.path.splitext(svg_file)[0].lower()
-        class_name = ''.join(c for c in class_name if c.isalnum() or c == '-')
-        
-        icon_classes += f"""
-        .{class_name}:before {{
-            content: "{char}";
-        }}"""
+        chars_by_svg.setdefault(svg_file, char)
+
+    for media, selectors, declarations in CSS_RULES:
+        resolved = []
+        for name, value in declarations:
+            if isinstance(value, tuple):
+                svg_file, default, *important = value
+                value = ' '.join([css_string(chars_by_svg.get(svg_file, default))] + important)
+            resolved.append((name, value))
+        yield media, selectors, resolved
+
+def css_icon_rules(created_glyphs):
+    """Классы отдельных иконок .icon-<имя> (по одному на SVG)"""
+    yield None, ICON_CLASS_SELECTORS, ICON_CLASS_DECLARATIONS
+    seen = set()
+    for char, svg_file in created_glyphs.items():
+        class_name = icon_class(svg_file)
+        if class_name and class_name not in seen:
+            seen.add(class_name)
+            yield None, (f".icon-{class_name}:before",), [('content', css_string(char))]
+
+def font_sources(output_base, fonts=None):
+    """Файлы шрифта для @font-face: [(имя или data URI, формат)], WOFF2 первым"""
+    if fonts is None:
+        fonts = {ext: f"{output_base}.{ext}" for ext in ('woff2', 'woff')}
+    return [(fonts[ext] if fonts[ext].startswith('data:') else os.path.basename(fonts[ext]), ext)
+            for ext in ('woff2', 'woff') if fonts.get(ext)]
+
+def write_css(f, output_base, created_glyphs, part='all', minify=False, font_display='block', fonts=None,
+              chunks=None):
+    """Записывает CSS: part — 'all', 'critical' (@font-face и правила по URL) или 'icons' (классы иконок)
+
+    fonts — созданные файлы шрифта {расширение: путь} (по умолчанию ProTo.woff2 и ProTo.woff);
+    chunks — части шрифта [(файл WOFF2, unicode-range)], по @font-face на каждую.
+    """
+    if part in ('all', 'critical'):
+        if chunks:
+            for font_file, chars_range in chunks:
+                f.write(css_block('@font-face', css_font_face([(os.path.basename(font_file), 'woff2')],
+                                                              font_display, chars_range), minify))
+        else:
+            font_files = font_sources(output_base, fonts)
+            f.write(css_block('@font-face', css_font_face(font_files, font_display), minify))
+        write_css_rules(f, css_glyph_rules(created_glyphs), minify)
+    if part in ('all', 'icons'):
+        write_css_rules(f, css_icon_rules(created_glyphs), minify)
 
-    html_content = f"""<!DOCTYPE html>
+def render_css(output_base, created_glyphs, part='all', minify=False, font_display='block', fonts=None):
+    """Текст CSS файла"""
+    buffer = io.StringIO()
+    write_css(buffer, output_base, created_glyphs, part, minify, font_display, fonts)
+    return buffer.getvalue()
+
+def create_css_file(output_base, created_glyphs, output_dir='.', fonts=None, chunks=None):
+    """Создание CSS файла (и отложенного CSS с классами иконок при --split-css)"""
+    minify, font_display = CSS_OPTIONS['minify'], CSS_OPTIONS['font_display']
+    parts = {f"{output_base}.css": 'critical', f"{output_base}.icons.css": 'icons'} if CSS_OPTIONS['split'] \
+        else {f"{output_base}.css": 'all'}
+    for name, part in parts.items():
+        css_file = os.path.join(output_dir, name)
+        with open_atomic(css_file) as f:
+            write_css(f, output_base, created_glyphs, part, minify, font_display, fonts, chunks)
+        log(f"✓ Создан CSS: {css_file}")
+
+    create_preload_snippet(output_base, output_dir, fonts)
+
+def preload_links(output_base, fonts=None):
+    """Теги для <head>: предзагрузка WOFF2, основной CSS и отложенный CSS иконок"""
+    links = [f'<link rel="preload" href="{font_file}" as="font" type="font/woff2" crossorigin>'
+             for font_file, fmt in font_sources(output_base, fonts) if fmt == 'woff2' and
+             not font_file.startswith('data:')]
+    links.append(f'<link rel="stylesheet" href="{output_base}.css">')
+    if CSS_OPTIONS['split']:
+        # Классы иконок не блокируют первую отрисовку
+        links.append(f'<link rel="stylesheet" href="{output_base}.icons.css" media="print" '
+                     f'onload="this.media=\'all\'">')
+        links.append(f'<noscript><link rel="stylesheet" href="{output_base}.icons.css"></noscript>')
+    return links
+
+def create_preload_snippet(output_base, output_dir='.', fonts=None):
+    """Фрагмент для вставки в <head> страниц сайта"""
+    snippet_file = os.path.join(output_dir, f"{output_base}.preload.html")
+    write_atomic(snippet_file, '\n'.join(preload_links(output_base, fonts)) + '\n')
+    log(f"✓ Создан фрагмент предзагрузки: {snippet_file}")
+
+# Дополнительные варианты доставки иконок (--inline-css, --sprite)
+TARGETS = {'inline_css': False, 'sprite': False}
+# WOFF2 больше этого размера выгоднее подключать отдельным файлом, чем встраивать в CSS
+INLINE_FONT_LIMIT = 32 * 1024
+
+def font_data_uri(data):
+    """WOFF2 в виде data URI для @font-face"""
+    import base64
+    return "data:font/woff2;base64," + base64.b64encode(data).decode('ascii')
+
+def create_inline_css(output_base, created_glyphs, woff2_path, output_dir='.'):
+    """CSS со встроенным в @font-face WOFF2 — иконки без отдельного запроса шрифта"""
+    if not woff2_path:
+        log("⚠ CSS со встроенным шрифтом не создан: нет WOFF2")
+        return
+    with open(woff2_path, 'rb') as f:
+        data = f.read()
+    if len(data) > INLINE_FONT_LIMIT:
+        log(f"⚠ WOFF2 {len(data) / 1024:.1f} KB: встраивание в CSS выгодно только для небольших подмножеств")
+
+    css_file = os.path.join(output_dir, f"{output_base}.inline.css")
+    with open_atomic(css_file) as f:
+        write_css(f, output_base, created_glyphs, 'all', CSS_OPTIONS['minify'], CSS_OPTIONS['font_display'],
+                  {'woff2': font_data_uri(data)})
+    log(f"✓ Создан CSS со встроенным шрифтом: {css_file}")
+
+def create_svg_sprite(output_base, created_glyphs, svg_dir, output_dir='.', em=1000):
+    """SVG-спрайт из тех же SVG, что и шрифт: <symbol id="icon-<имя>"> на каждую иконку"""
+    import xml.etree.ElementTree as ElementTree
+    sprite_file = os.path.join(output_dir, f"{output_base}.sprite.svg")
+    seen = set()
+    with open_atomic(sprite_file) as f:
+        f.write('<svg xmlns="http://www.w3.org/2000/svg" style="display:none">\n')
+        for char, svg_file in created_glyphs.items():
+            class_name = icon_class(svg_file)
+            if class_name in seen:
+                continue
+            seen.add(class_name)
+            try:
+                with open(os.path.join(svg_dir, svg_file), 'rb') as svg:
+                    width, body = svg_outline(svg.read(), em, svg_file)
+            except (OSError, ElementTree.ParseError, ValueError) as e:
+                log(f"⚠ {svg_file} не добавлен в спрайт: {e}")
+                continue
+            f.write(f'<symbol id="icon-{class_name}" viewBox="0 0 {width} {em}">{body}</symbol>\n')
+        f.write('</svg>\n')
+    log(f"✓ Создан SVG-спрайт: {sprite_file}")
+
+def transfer_size(path):
+    """Размер при передаче: текстовые файлы сжимаются gzip, шрифты уже сжаты"""
+    import gzip
+    with open(path, 'rb') as f:
+        data = f.read()
+    if path.endswith(('.woff', '.woff2')):
+        return len(data), len(data)
+    return len(data), len(gzip.compress(data, 9))
+
+def print_size_report(output_base, output_dir, fonts):
+    """Сравнение вариантов доставки: число запросов, размер без сжатия и при передаче"""
+    css_files = [os.path.join(output_dir, f"{output_base}.css")]
+    if CSS_OPTIONS['split']:
+        css_files.append(os.path.join(output_dir, f"{output_base}.icons.css"))
+    variants = [
+        ("CSS + WOFF2", css_files + [fonts.get('woff2')]),
+        ("CSS + WOFF", css_files + [fonts.get('woff')]),
+        ("Встроенный CSS", [os.path.join(output_dir, f"{output_base}.inline.css")]),
+        ("SVG-спрайт", [os.path.join(output_dir, f"{output_base}.sprite.svg")]),
+    ]
+
+    log("\n📦 Варианты доставки (передача: gzip для текста):")
+    log(f"  {'Вариант':<16}  {'Запросов':>8}  {'Размер, KB':>10}  {'Передача, KB':>12}")
+    for label, paths in variants:
+        if not all(path and os.path.exists(path) for path in paths):
+            continue
+        sizes = [transfer_size(path) for path in paths]
+        raw = sum(size for size, _ in sizes)
+        sent = sum(size for _, size in sizes)
+        log(f"  {label:<16}  {len(paths):>8}  {raw / 1024:>10.1f}  {sent / 1024:>12.1f}")
+
+# Размер глифов (--glyph-sizes) и бюджеты в байтах (--budget-glyph, --budget-total)
+SIZE_BUDGET = {'report': False, 'glyph': None, 'total': None}
+# До этого числа глифов вклад считается исключением по одному, дальше — потоковым сжатием
+ATTRIBUTION_EXACT_LIMIT = 256
+# Качество brotli для оценки вклада исключением: q11 на 256 глифах сжимает
+# таблицу glyf 257 раз и занимает минуты, q5 — около секунды при близком результате
+ATTRIBUTION_QUALITY = 5
+
+def cmap_codepoints(cmap):
+    """Коды символов каждого глифа из таблицы cmap (форматы 4 и 12): {номер глифа: [коды]}"""
+    codepoints = {}
+    num_tables = struct.unpack_from('>H', cmap, 2)[0]
+    subtables = sorted({struct.unpack_from('>L', cmap, 8 + i * 8)[0] for i in range(num_tables)})
+    for offset in subtables:
+        fmt = struct.unpack_from('>H', cmap, offset)[0]
+        if fmt == 4:
+            segments = struct.unpack_from('>H', cmap, offset + 6)[0] // 2
+            ends = offset + 14
+            starts = ends + segments * 2 + 2
+            deltas = starts + segments * 2
+            ranges = deltas + segments * 2
+            for i in range(segments):
+                end = struct.unpack_from('>H', cmap, ends + i * 2)[0]
+                start = struct.unpack_from('>H', cmap, starts + i * 2)[0]
+                delta = struct.unpack_from('>h', cmap, deltas + i * 2)[0]
+                range_offset = struct.unpack_from('>H', cmap, ranges + i * 2)[0]
+                for codepoint in range(start, min(end, 0xFFFE) + 1):
+                    if range_offset:
+                        address = ranges + i * 2 + range_offset + (codepoint - start) * 2
+                        glyph_id = struct.unpack_from('>H', cmap, address)[0]
+                        glyph_id = (glyph_id + delta) & 0xFFFF if glyph_id else 0
+                    else:
+                        glyph_id = (codepoint + delta) & 0xFFFF
+                    if glyph_id:
+                        codepoints.setdefault(glyph_id, set()).add(codepoint)
+        elif fmt == 12:
+            groups = struct.unpack_from('>L', cmap, offset + 12)[0]
+            for i in range(groups):
+                start, end, glyph_id = struct.unpack_from('>LLL', cmap, offset + 16 + i * 12)
+                for codepoint in range(start, end + 1):
+                    codepoints.setdefault(glyph_id + codepoint - start, set()).add(codepoint)
+    return {glyph_id: sorted(values) for glyph_id, values in codepoints.items()}
+
+def glyph_records(ttf_data):
+    """Записи глифов из glyf/loca: [(номер глифа, коды символов, байты записи)]"""
+    tables = {tag: data for tag, _, data in read_sfnt_tables(ttf_data)[1]}
+    long_offsets = struct.unpack_from('>h', tables[b'head'], 50)[0] == 1
+    num_glyphs = struct.unpack_from('>H', tables[b'maxp'], 4)[0]
+    if long_offsets:
+        offsets = struct.unpack_from(f'>{num_glyphs + 1}L', tables[b'loca'])
+    else:
+        offsets = [offset * 2 for offset in struct.unpack_from(f'>{num_glyphs + 1}H', tables[b'loca'])]
+    codepoints = cmap_codepoints(tables[b'cmap']) if b'cmap' in tables else {}
+    glyf = tables[b'glyf']
+    return [(glyph_id, codepoints.get(glyph_id, []), glyf[offsets[glyph_id]:offsets[glyph_id + 1]])
+            for glyph_id in range(num_glyphs)]
+
+def glyph_points(record):
+    """Число точек простого глифа (None — составной глиф из ссылок)"""
+    if not record:
+        return 0
+    contours = struct.unpack_from('>h', record)[0]
+    if contours < 0:
+        return None
+    return struct.unpack_from('>H', record, 10 + (contours - 1) * 2)[0] + 1 if contours else 0
+
+def glyph_references(record):
+    """Номера глифов, на которые ссылается составной глиф"""
+    references = []
+    offset = 10
+    flags = 0x20
+    while flags & 0x20:
+        flags, glyph_id = struct.unpack_from('>HH', record, offset)
+        references.append(glyph_id)
+        # Аргументы (слова или байты) и матрица: масштаб, масштаб по осям или 2×2
+        offset += 4 + (4 if flags & 0x1 else 2)
+        offset += 2 if flags & 0x8 else 4 if flags & 0x40 else 8 if flags & 0x80 else 0
+    return references
+
+def compressor():
+    """Сжатие для оценки вклада: brotli, как в WOFF2, или zlib, как в WOFF"""
+    if importlib.util.find_spec('brotli'):
+        import brotli
+        return 'brotli', lambda data: len(brotli.compress(data, quality=ATTRIBUTION_QUALITY)), \
+            lambda: (lambda stream: (stream.process, stream.flush))(brotli.Compressor())
+    return 'zlib', lambda data: len(zlib.compress(data, 9)), \
+        lambda: (lambda stream: (stream.compress, lambda: stream.flush(zlib.Z_SYNC_FLUSH)))(zlib.compressobj(9))
+
+def glyph_costs(records):
+    """Вклад каждого глифа в сжатый размер glyf, байт: (метод, [вклад])
+
+    На небольших шрифтах глиф по очереди исключается и таблица сжимается
+    заново; на больших глифы подаются в потоковый кодировщик по одному,
+    и вкладом считается вывод после сброса потока.
+    """
+    name, compressed_size, stream = compressor()
+    parts = [record for _, _, record in records]
+    if len(parts) <= ATTRIBUTION_EXACT_LIMIT:
+        full = compressed_size(b''.join(parts))
+        return f"{name}, исключение по одному", [
+            full - compressed_size(b''.join(parts[:i] + parts[i + 1:])) for i in range(len(parts))]
+    process, flush = stream()
+    costs = []
+    for part in parts:
+        costs.append(len(process(part)) + len(flush()))
+    return f"{name}, потоковое сжатие", costs
+
+def report_glyph_sizes(ttf_data, created_glyphs, woff2_path=None):
+    """Печатает вклад глифов в размер шрифта (худшие первыми) и проверяет бюджеты
+
+    Возвращает False, если бюджет глифа или всего шрифта превышен.
+    """
+    records = glyph_records(ttf_data)
+    method, costs = glyph_costs(records)
+    names = {glyph_id: ', '.join(created_glyphs.get(chr(codepoint), '?') for codepoint in codepoints)
+             for glyph_id, codepoints, record in records}
+    users = {}
+    for glyph_id, codepoints, record in records:
+        if glyph_points(record) is None:
+            for reference in glyph_references(record):
+                users.setdefault(reference, []).append(names[glyph_id])
+    rows = []
+    for (glyph_id, codepoints, record), cost in zip(records, costs):
+        chars = [chr(codepoint) for codepoint in codepoints]
+        if chars:
+            label = ', '.join(f"{created_glyphs.get(char, '?')} ({css_string(char)})" for char in chars)
+        elif glyph_id in users:
+            label = f"#{glyph_id} в {', '.join(users[glyph_id])}"
+        else:
+            label = '.notdef' if glyph_id == 0 else f"глиф #{glyph_id}"
+        rows.append((cost, label, glyph_points(record), len(record)))
+    rows.sort(key=lambda row: -row[0])
+
+    log(f"\n📏 Вклад глифов в размер ({method}):")
+    log(f"  {'Глиф':<32}  {'Точек':>6}  {'glyf, Б':>8}  {'Вклад, Б':>9}")
+    shown = rows if OUTPUT['verbose'] or len(rows) <= GLYPH_LOG_LIMIT else rows[:20]
+    for cost, label, points, size in shown:
+        points = 'ссылки' if points is None else points
+        log(f"  {label[:32]:<32}  {points:>6}  {size:>8}  {cost:>9}")
+    if len(shown) < len(rows):
+        log(f"  • и еще {len(rows) - len(shown)} глифов (-v — все)")
+
+    ok = True
+    limit = SIZE_BUDGET['glyph']
+    if limit is not None:
+        over = [row for row in rows if row[0] > limit]
+        for cost, label, points, size in over:
+            log(f"❌ Бюджет глифа превышен: {label} — {cost} Б > {limit} Б")
+        ok = not over
+    total = os.path.getsize(woff2_path) if woff2_path and os.path.exists(woff2_path) else None
+    if total is not None:
+        log(f"  Итого WOFF2: {total} Б" + (f" (бюджет {SIZE_BUDGET['total']} Б)" if SIZE_BUDGET['total'] else ''))
+    if SIZE_BUDGET['total'] is not None:
+        if total is None:
+            # Без WOFF2 бюджет проверяется по сжатой таблице glyf
+            total = sum(cost for cost, *_ in rows)
+        if total > SIZE_BUDGET['total']:
+            log(f"❌ Бюджет шрифта превышен: {total} Б > {SIZE_BUDGET['total']} Б")
+            ok = False
+    return ok
+
+# Скрипт демо-страницы: карточки строятся из JSON только для видимых строк сетки
+DEMO_SCRIPT = """
+        (function () {
+            var glyphs = JSON.parse(document.getElementById('glyphs').textContent);
+            var viewport = document.getElementById('viewport');
+            var spacer = document.getElementById('spacer');
+            var grid = document.getElementById('grid');
+            var search = document.getElementById('search');
+            var counter = document.getElementById('counter');
+            var CARD_WIDTH = 150, ROW_HEIGHT = 160, GAP = 20;
+            var shown = glyphs, scheduled = false;
+
+            function code(cp) {
+                return 'U+' + cp.toString(16).toUpperCase().padStart(4, '0');
+            }
+
+            function card(glyph) {
+                var div = document.createElement('div');
+                div.className = 'card';
+                var icon = document.createElement('div');
+                icon.className = 'glyph';
+                icon.textContent = String.fromCodePoint(glyph[1]);
+                var label = document.createElement('div');
+                label.className = 'label';
+                label.textContent = glyph[0];
+                var char = document.createElement('div');
+                char.className = 'char';
+                char.textContent = "'" + String.fromCodePoint(glyph[1]) + "' (" + code(glyph[1]) + ")";
+                div.append(icon, label, char);
+                return div;
+            }
+
+            function render() {
+                scheduled = false;
+                var columns = Math.max(1, Math.floor((viewport.clientWidth + GAP) / (CARD_WIDTH + GAP)));
+                var rows = Math.ceil(shown.length / columns);
+                var first = Math.floor(viewport.scrollTop / ROW_HEIGHT);
+                var visible = Math.ceil(viewport.clientHeight / ROW_HEIGHT) + 1;
+                spacer.style.height = rows * ROW_HEIGHT + 'px';
+                grid.style.gridTemplateColumns = 'repeat(' + columns + ', 1fr)';
+                grid.style.transform = 'translateY(' + first * ROW_HEIGHT + 'px)';
+                var cards = document.createDocumentFragment();
+                var end = Math.min(shown.length, (first + visible) * columns);
+                for (var i = first * columns; i < end; i++) {
+                    cards.append(card(shown[i]));
+                }
+                grid.replaceChildren(cards);
+                counter.textContent = shown.length + ' из ' + glyphs.length;
+            }
+
+            function schedule() {
+                if (!scheduled) {
+                    scheduled = true;
+                    requestAnimationFrame(render);
+                }
+            }
+
+            search.addEventListener('input', function () {
+                var query = search.value.trim().toLowerCase();
+                shown = !query ? glyphs : glyphs.filter(function (glyph) {
+                    return glyph[0].indexOf(query) >= 0 || code(glyph[1]).toLowerCase().indexOf(query) >= 0 ||
+                        String.fromCodePoint(glyph[1]) === search.value.trim();
+                });
+                viewport.scrollTop = 0;
+                schedule();
+            });
+            viewport.addEventListener('scroll', schedule);
+            window.addEventListener('resize', schedule);
+            render();
+
+            document.getElementById('testInput').addEventListener('input', function(e) {
+                document.getElementById('testOutput').textContent = e.target.value;
+            });
+        })();
+"""
+
+def create_html_demo(output_base, created_glyphs, output_dir='.', fonts=None):
+    """Создание HTML демо: список глифов — компактный JSON, карточки
+    отрисовываются скриптом только для видимой части (виртуальная прокрутка)"""
+    links = '\n    '.join(preload_links(output_base, fonts))
+    head = f"""<!DOCTYPE html>
 <html>
 <head>
     <meta charset="UTF-8">
     <title>ProTo Icon Font Demo</title>
-    <link rel="stylesheet" href="{output_base}.css">
+    {links}
     <style>
         body {{ font-family: sans-serif; margin: 40px; background: #f5f5f5; }}
         .container {{ max-width: 1200px; margin: 0 auto; background: white; padding: 30px; border-radius: 10px; }}
         h1 {{ color: #333; }}
         .grid {{ display: grid; grid-template-columns: repeat(auto-fill, minmax(150px, 1fr)); gap: 20px; margin-top: 30px; }}
-        .card {{ text-align: center; padding: 20px; border: 1px solid #ddd; border-radius: 8px; }}
+        .search {{ width: 100%; padding: 10px; font-size: 16px; box-sizing: border-box; }}
+        .viewport {{ height: 70vh; overflow-y: auto; margin-top: 20px; }}
+        .spacer {{ position: relative; }}
+        .spacer .grid {{ position: absolute; top: 0; left: 0; right: 0; margin-top: 0; }}
+        .card {{ text-align: center; padding: 20px; border: 1px solid #ddd; border-radius: 8px; height: 140px; box-sizing: border-box; overflow: hidden; }}
         .card:hover {{ box-shadow: 0 5px 15px rgba(0,0,0,0.1); }}
-        .card .icon {{ font-size: 48px; color: #007bff; }}
-        .card .label {{ margin-top: 10px; font-size: 14px; color: #666; }}
+        .card .glyph {{ font-family: 'ProTo'; font-size: 48px; line-height: 1; color: #007bff; }}
+        .card .label {{ margin-top: 10px; font-size: 14px; color: #666; white-space: nowrap; overflow: hidden; text-overflow: ellipsis; }}
         .card .char {{ font-family: monospace; background: #f0f0f0; padding: 4px; border-radius: 4px; font-size: 12px; }}
         .test-area {{ margin-top: 40px; padding: 20px; background: #e3f2fd; border-radius: 8px; }}
-        .test-input {{ width: 100%%; padding: 10px; font-size: 24px; font-family: 'ProTo'; margin-top: 10px; }}
-                /* Icon classes */
-        {icon_classes}
-        .rub:before {{
-        content: none
-        }}
+        .test-input {{ width: 100%; padding: 10px; font-size: 24px; font-family: 'ProTo'; margin-top: 10px; }}
     </style>
 </head>
 <body>
     <div class="container">
         <h1>ProTo Icon Font</h1>
         <p>Всего иконок: {len(created_glyphs)}</p>
-        
-        <div class="grid icons">
-"""
 
-    for char, svg_file in created_glyphs.items():
-        class_name = os.path.splitext(svg_file)[0].lower()
-        class_name = ''.join(c for c in class_name if c.isalnum() or c == '-')
-        
-        html_content += f"""
-            <div class="card">
-                <div class="icon {class_name}"></div>
-                <div class="label">{class_name}</div>
-                <div class="char">'{char}' (U+{ord(char):04X})</div>
-            </div>"""
-
-    html_content += f"""
+        <input type="search" class="search" id="search" placeholder="Поиск по имени или коду (vk, e001)">
+        <p id="counter"></p>
+        <div class="viewport" id="viewport">
+            <div class="spacer" id="spacer"><div class="grid" id="grid"></div></div>
         </div>
+        <script type="application/json" id="glyphs">["""
+
+    tail = f"""]</script>
         
         <div class="test-area">
             <h3>Тестовая область</h3>
@@ -588,49 +2945,819 @@ class для одиночной иконки icon</strong></p>
 
 
 
-        <script>
-            document.getElementById('testInput').addEventListener('input', function(e) {{
-                document.getElementById('testOutput').textContent = e.target.value;
-            }});
-        </script>
+        <script>{DEMO_SCRIPT}        </script>
     </div>
 </body>
 </html>"""
 
-    html_file = f"{output_base}.html"
-    with open(html_file, "w", encoding='utf-8') as f:
-        f.write(html_content)
+    html_file = os.path.join(output_dir, f"{output_base}.html")
+    with open_atomic(html_file) as f:
+        f.write(head)
+        # Глифы пишутся по одному: [класс, код]; имя класса вычисляется один раз
+        for i, (char, svg_file) in enumerate(created_glyphs.items()):
+            f.write((',' if i else '') + json.dumps([icon_class(svg_file), ord(char)], separators=(',', ':')))
+        f.write(tail)
     
-    print(f"✓ Создан HTML демо: {html_file}")
+    log(f"✓ Создан HTML демо: {html_file}")
+
+# Разбор CSS и страниц для подбора подмножеств шрифта
+CSS_RULE_RE = re.compile(r'([^{}]*)\{([^{}]*)\}')
+CSS_CONTENT_RE = re.compile(r'content\s*:\s*(["\'])(.*?)\1')
+CSS_ESCAPE_RE = re.compile(r'\\([0-9a-fA-F]{1,6}\s?|.)')
+CSS_ATTR_RE = re.compile(r'\[\s*href\s*([*^$]?)=\s*(["\'])(.*?)\2\s*\]')
+CSS_CLASS_RE = re.compile(r'\.([A-Za-z_][\w-]*)')
+HTML_HREF_RE = re.compile(r'href\s*=\s*(["\'])(.*?)\1', re.I | re.S)
+HTML_CLASS_RE = re.compile(r'class\s*=\s*(["\'])(.*?)\1', re.I | re.S)
+
+def css_unescape(value):
+    """Раскрывает экранирование CSS: \\e001 → символ U+E001"""
+    def replace(match):
+        escape = match.group(1)
+        if re.fullmatch(r'[0-9a-fA-F]{1,6}\s?', escape):
+            return chr(int(escape, 16))
+        return escape
+    return CSS_ESCAPE_RE.sub(replace, value)
+
+def css_content_chars(body):
+    """Символы из значений content: в теле правила"""
+    chars = ''
+    for _, value in CSS_CONTENT_RE.findall(body):
+        chars += css_unescape(value)
+    return chars
+
+def split_selectors(selector):
+    """Делит список селекторов по запятым верхнего уровня (не внутри :is(...) и [...])"""
+    parts, depth, current = [], 0, ''
+    for c in selector:
+        if c in '([':
+            depth += 1
+        elif c in ')]':
+            depth -= 1
+        if c == ',' and depth == 0:
+            parts.append(current.strip())
+            current = ''
+        else:
+            current += c
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+def href_matches(operator, value, href):
+    """Проверяет ссылку по условию атрибута CSS ([href*=], [href^=], [href$=], [href=])"""
+    if operator == '*':
+        return value in href
+    if operator == '^':
+        return href.startswith(value)
+    if operator == '$':
+        return href.endswith(value)
+    return href == value
+
+def selector_used(selector, usage):
+    """Может ли селектор сработать на странице: все его классы встречаются
+    на странице, а одно из условий на href выполняется хотя бы для одной ссылки"""
+    classes = set(CSS_CLASS_RE.findall(re.sub(r'\[[^\]]*\]', '', selector)))
+    if not classes <= usage['classes']:
+        return False
+    conditions = CSS_ATTR_RE.findall(selector)
+    if not conditions:
+        return True
+    return any(href_matches(operator, value, href)
+               for operator, _, value in conditions for href in usage['hrefs'])
+
+def scan_usage(paths, font_chars):
+    """Собирает ссылки, классы и символы шрифта, встречающиеся в файлах"""
+    usage = {'hrefs': set(), 'classes': set(), 'chars': set()}
+    for path in paths:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            text = f.read()
+        usage['hrefs'].update(href for _, href in HTML_HREF_RE.findall(text))
+        for _, value in HTML_CLASS_RE.findall(text):
+            usage['classes'].update(value.split())
+        if path.endswith('.css'):
+            for _, body in CSS_RULE_RE.findall(text):
+                usage['chars'].update(css_content_chars(body))
+        # Буквальные символы: ASCII встречается в любом тексте, поэтому учитываем только остальные
+        usage['chars'].update(c for c in set(text) & font_chars if ord(c) > 127)
+    usage['chars'] &= font_chars
+    return usage
+
+def glyphs_used(css_text, usage, font_chars):
+    """Символы шрифта, которые понадобятся странице с такими ссылками и классами"""
+    used = set(usage['chars'])
+    for selector, body in CSS_RULE_RE.findall(css_text):
+        chars = set(css_content_chars(body)) & font_chars
+        if chars and any(selector_used(part, usage) for part in split_selectors(selector)):
+            used |= chars
+    return used
+
+def subset_css(css_text, font_file, chars, minify=None, font_display=None):
+    """CSS для подмножества: @font-face на файл подмножества, правила
+    с отсутствующими в нем глифами удаляются
+
+    minify и font_display по умолчанию берутся из CSS_OPTIONS.
+    """
+    def keep(match):
+        content = css_content_chars(match.group(2))
+        if content and not set(content) <= chars:
+            return ''
+        return match.group(0)
+
+    css_text = CSS_RULE_RE.sub(keep, css_text)
+    minify = CSS_OPTIONS['minify'] if minify is None else minify
+    font_display = CSS_OPTIONS['font_display'] if font_display is None else font_display
+    font_face = css_block('@font-face', css_font_face([(font_file, 'woff2')], font_display), minify).rstrip('\n')
+    return re.sub(r'@font-face\s*\{[^}]*\}', lambda match: font_face, css_text, count=1)
+
+def parse_bundles(specs):
+    """Разбирает наборы страниц: «имя=шаблон» или просто путь (имя — имя файла)"""
+    bundles = {}
+    for spec in specs:
+        name, _, pattern = spec.rpartition('=')
+        if not name:
+            name = os.path.splitext(os.path.basename(pattern))[0]
+        paths = sorted(glob.glob(pattern, recursive=True)) or [pattern]
+        bundles.setdefault(name, []).extend(paths)
+    return bundles
+
+def build_subsets(svg_dir, output_base, mapping, bundle_specs, woff2_converter, cache_dir=CACHE_DIR, output_dir='.',
+                  settings=GLYPH_SETTINGS):
+    """Собирает для каждого набора страниц WOFF2 только с используемыми глифами"""
+    if not woff2_converter:
+        log("❌ Для подмножеств нужен конвертер WOFF2")
+        return False
+
+    glyphs = {char: svg_file for char, svg_file in mapping.items()
+              if len(char) == 1 and os.path.exists(os.path.join(svg_dir, svg_file))}
+    font_chars = set(glyphs)
+    css_text = render_css(output_base, glyphs, minify=CSS_OPTIONS['minify'], font_display=CSS_OPTIONS['font_display'])
+    os.makedirs(output_dir, exist_ok=True)
+
+    log(f"\n=== Подмножества шрифта ===")
+    ok = True
+    for name, paths in parse_bundles(bundle_specs).items():
+        try:
+            usage = scan_usage(paths, font_chars)
+        except OSError as e:
+            log(f"❌ {name}: {e}")
+            ok = False
+            continue
+
+        used = glyphs_used(css_text, usage, font_chars)
+        subset = {char: svg_file for char, svg_file in glyphs.items() if char in used}
+        if not subset:
+            log(f"  • {name}: иконки не используются, подмножество не нужно")
+            continue
+
+        with quiet_output():
+            font, created_glyphs = build_font(svg_dir, output_base, subset, cache_dir, settings=settings)
+        data = convert_to_woff2(generate_ttf_data(font), woff2_converter)
+        font.close()
+        if data is None:
+            ok = False
+            continue
+
+        font_file = font_file_name(f"{output_base}.{name}", 'woff2', data)
+        write_atomic(os.path.join(output_dir, font_file), data)
+        write_atomic(os.path.join(output_dir, f"{output_base}.{name}.css"),
+                     subset_css(css_text, font_file, set(created_glyphs)))
+        log(f"  ✓ {name}: {len(created_glyphs)} из {len(glyphs)} глифов "
+              f"({''.join(sorted(created_glyphs))}) → {font_file} ({len(data) / 1024:.1f} KB)")
+        if TARGETS['inline_css']:
+            inline_file = os.path.join(output_dir, f"{output_base}.{name}.inline.css")
+            write_atomic(inline_file, subset_css(css_text, font_data_uri(data), set(created_glyphs)))
+            raw, sent = transfer_size(inline_file)
+            log(f"    встроенный CSS: {raw / 1024:.1f} KB (gzip {sent / 1024:.1f} KB), 1 запрос вместо 2")
+    return ok
+
+def load_groups(path):
+    """Читает группы иконок из JSON: {"группа": ["имя.svg" или шаблон, ...]}"""
+    with open(path, encoding='utf-8') as f:
+        groups = json.load(f)
+    if not isinstance(groups, dict) or not all(isinstance(patterns, list) for patterns in groups.values()):
+        raise ValueError("ожидается объект {группа: [имена SVG]}")
+    return groups
+
+def group_mapping(mapping, groups):
+    """Разбивает сопоставление по группам: иконка попадает в первую подходящую группу, остальные — в other"""
+    chunks = {name: {} for name in groups}
+    for char, svg_file in mapping.items():
+        group = next((name for name, patterns in groups.items()
+                      if any(fnmatch.fnmatchcase(svg_file, pattern) for pattern in patterns)), 'other')
+        chunks.setdefault(group, {})[char] = svg_file
+    return {name: chunk for name, chunk in chunks.items() if chunk}
+
+def build_chunks(svg_dir, output_base, mapping, groups, woff2_converter, cache_dir=CACHE_DIR, output_dir='.',
+                 settings=GLYPH_SETTINGS):
+    """Собирает по WOFF2 на группу иконок и общий CSS с @font-face для каждой части
+
+    Все части объявлены в одном семействе ProTo; по unicode-range браузер
+    загружает только те файлы, символы которых есть на странице.
+    """
+    if not woff2_converter:
+        log("❌ Для раздельных шрифтов нужен конвертер WOFF2")
+        return False
+
+    glyphs = {char: svg_file for char, svg_file in mapping.items()
+              if len(char) == 1 and os.path.exists(os.path.join(svg_dir, svg_file))}
+    os.makedirs(output_dir, exist_ok=True)
+
+    log(f"\n=== Раздельные шрифты по группам ===")
+    chunks, created = [], {}
+    for name, chunk in group_mapping(glyphs, groups).items():
+        with quiet_output():
+            font, created_glyphs = build_font(svg_dir, output_base, chunk, cache_dir, settings=settings)
+        data = convert_to_woff2(generate_ttf_data(font), woff2_converter)
+        font.close()
+        if data is None:
+            return False
+
+        font_file = font_file_name(f"{output_base}.{name}", 'woff2', data)
+        write_atomic(os.path.join(output_dir, font_file), data)
+        chars_range = unicode_range(created_glyphs)
+        chunks.append((font_file, chars_range))
+        created.update(created_glyphs)
+        log(f"  ✓ {name}: {len(created_glyphs)} глифов → {font_file} ({len(data) / 1024:.1f} KB), {chars_range}")
+
+    if not created:
+        log("❌ Не создано ни одного глифа")
+        return False
+    # Шрифты загружаются по требованию, поэтому ни один из них не предзагружается
+    create_css_file(output_base, created, output_dir, fonts={}, chunks=chunks)
+    create_html_demo(output_base, created, output_dir, fonts={})
+    write_glyph_manifest(output_base, output_dir, created, chunks=chunks, em=settings['em'])
+    return True
+
+# Программный интерфейс и локальный сервис сборки
+# fontforge не потокобезопасен: импорт глифов и генерация TTF выполняются по одному
+FONTFORGE_LOCK = threading.Lock()
+# Типы ответов сервиса по расширению
+SERVE_TYPES = {'woff2': 'font/woff2', 'woff': 'font/woff', 'css': 'text/css; charset=utf-8'}
+
+def build_icon_font(mapping, svg_sources, output_base='ProTo', subset=None, settings=GLYPH_SETTINGS,
+                    cache_dir=CACHE_DIR, woff_converter=None, woff2_converter=None, font_url=None,
+                    hashed=False, minify=False, font_display='block'):
+    """Собирает шрифт в памяти и возвращает файлы {имя: байты}: WOFF2, WOFF и CSS
+
+    svg_sources — директория с SVG или словарь {имя SVG: содержимое}; subset —
+    символы, которые нужно оставить (None — все). Конвертеры по умолчанию
+    выбираются как в командной строке. font_url(расширение) задает адрес
+    файла шрифта в @font-face (по умолчанию — имя файла). hashed, minify и
+    font_display — то же, что --hashed-names, --minify-css и --font-display;
+    глобальные настройки командной строки не используются. Сообщения сборки
+    не выводятся, стандартный вывод процесса не подменяется.
+    """
+    if woff_converter is None and woff2_converter is None:
+        with quiet_output():
+            _, woff_converter, woff2_converter = check_dependencies(cache_dir=cache_dir)
+    if subset is not None:
+        subset = set(subset)
+        mapping = {char: svg_file for char, svg_file in mapping.items() if char in subset}
+
+    with scratch_dir() as tmp:
+        svg_dir = svg_sources
+        if isinstance(svg_sources, dict):
+            svg_dir = os.path.join(tmp, 'icons')
+            os.makedirs(svg_dir)
+            for svg_file, data in svg_sources.items():
+                with open(os.path.join(svg_dir, os.path.basename(svg_file)), 'wb') as f:
+                    f.write(data.encode('utf-8') if isinstance(data, str) else data)
+
+        with FONTFORGE_LOCK, quiet_output():
+            font, created_glyphs = build_font(svg_dir, output_base, mapping, cache_dir, settings=settings)
+            try:
+                if not created_glyphs:
+                    raise ValueError("не создано ни одного глифа")
+                ttf_data = generate_ttf_data(font)
+            finally:
+                font.close()
+
+    artifacts = {}
+    fonts = {}
+    for ext, convert, converter in (('woff2', convert_to_woff2, woff2_converter),
+                                    ('woff', convert_to_woff, woff_converter)):
+        data = convert(ttf_data, converter) if converter else None
+        if data is not None:
+            name = font_file_name(output_base, ext, data, hashed)
+            artifacts[name] = data
+            fonts[ext] = font_url(ext) if font_url else name
+    if not fonts:
+        raise RuntimeError("не удалось создать ни WOFF, ни WOFF2")
+    css_text = render_css(output_base, created_glyphs, minify=minify, font_display=font_display, fonts=fonts)
+    if subset is not None and 'woff2' in fonts:
+        # Правила с глифами, которых нет в подмножестве, не нужны
+        css_text = subset_css(css_text, fonts['woff2'], set(created_glyphs), minify, font_display)
+    artifacts[f"{output_base}.css"] = css_text.encode('utf-8')
+    return artifacts
+
+def icon_set_digest(svg_dir, mapping):
+    """Хэш набора иконок: сопоставление и время изменения/размер SVG"""
+    digest = hashlib.sha256(json.dumps(mapping, sort_keys=True).encode())
+    digest.update(json.dumps(sorted(svg_snapshot(svg_dir).items())).encode())
+    return digest.hexdigest()
+
+class ArtifactCache:
+    """LRU-кэш собранных файлов в памяти с ограничением по суммарному размеру"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        # Сборки, которые сейчас выполняются: {ключ: событие завершения}
+        self.pending = {}
+
+    def get_or_build(self, key, build):
+        """Возвращает (файлы, взяты ли из кэша); одновременные промахи по одному
+        ключу ждут первую сборку, а не повторяют ее"""
+        while True:
+            with self.lock:
+                artifacts = self.entries.get(key)
+                if artifacts is not None:
+                    self.entries.move_to_end(key)
+                    return artifacts, True
+                pending = self.pending.get(key)
+                if pending is None:
+                    pending = self.pending[key] = threading.Event()
+                    break
+            # Если первая сборка упала, следующий запрос соберет сам
+            pending.wait()
+        try:
+            artifacts = build()
+            self.put(key, artifacts)
+            return artifacts, False
+        finally:
+            with self.lock:
+                del self.pending[key]
+            pending.set()
+
+    def put(self, key, artifacts):
+        size = sum(len(data) for data in artifacts.values())
+        with self.lock:
+            if key in self.entries:
+                self.size -= sum(len(data) for data in self.entries.pop(key).values())
+            self.entries[key] = artifacts
+            self.size += size
+            # Вытесняем давно не запрошенные наборы, пока не уложимся в лимит
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= sum(len(data) for data in evicted.values())
+
+def request_subset(query, mapping):
+    """Символы подмножества из запроса: chars=<символы> и/или icons=<имя>,<имя>"""
+    chars = set(''.join(query.get('chars', [])))
+    names = {name.strip() for value in query.get('icons', []) for name in value.split(',') if name.strip()}
+    if names:
+        chars |= {char for char, svg_file in mapping.items() if icon_class(svg_file) in names}
+    return ''.join(sorted(chars)) if chars or 'chars' in query or 'icons' in query else None
+
+def serve(port, svg_dir, output_base, mapping, woff_converter, woff2_converter, cache_dir=CACHE_DIR,
+          settings=GLYPH_SETTINGS, cache_size=64 * 1024 * 1024, minify=False, font_display='block'):
+    """Локальный HTTP-сервис: GET /ProTo.woff2, /ProTo.woff, /ProTo.css с ?chars= или ?icons=
+
+    Результаты хранятся в LRU-кэше по хэшу набора иконок и подмножеству.
+    """
+    import http.server
+    import urllib.parse
+    cache = ArtifactCache(cache_size)
+
+    def artifact(ext, query):
+        subset = request_subset(query, mapping)
+        key = (icon_set_digest(svg_dir, mapping), subset)
+        suffix = '?' + urllib.parse.urlencode({'chars': subset}) if subset is not None else ''
+
+        def build():
+            with span('serve-build', subset=subset or ''):
+                return build_icon_font(mapping, svg_dir, output_base, subset, settings, cache_dir,
+                                       woff_converter, woff2_converter,
+                                       font_url=lambda font_ext: f"{output_base}.{font_ext}{suffix}",
+                                       minify=minify, font_display=font_display)
+
+        artifacts, hit = cache.get_or_build(key, build)
+        for name, data in artifacts.items():
+            if name.endswith('.' + ext):
+                return data, hit
+        return None, hit
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            name = url.path.lstrip('/')
+            ext = name.rpartition('.')[2]
+            if name.rpartition('.')[0] != output_base or ext not in SERVE_TYPES:
+                self.send_error(404, explain=f"Доступны {output_base}.woff2, {output_base}.woff и {output_base}.css")
+                return
+            started = time.perf_counter()
+            try:
+                data, hit = artifact(ext, urllib.parse.parse_qs(url.query))
+            except Exception as e:
+                log(f"❌ {self.path}: {e}")
+                self.send_error(500, explain=str(e))
+                return
+            if data is None:
+                self.send_error(404, explain=f"Формат {ext} недоступен: нет конвертера")
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', SERVE_TYPES[ext])
+            self.send_header('Content-Length', str(len(data)))
+            self.send_header('ETag', '"' + hashlib.sha256(data).hexdigest()[:16] + '"')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.send_header('X-Cache', 'hit' if hit else 'miss')
+            self.end_headers()
+            self.wfile.write(data)
+            log(f"  {'♻' if hit else '⚙'} {self.path} → {len(data) / 1024:.1f} KB "
+                f"за {(time.perf_counter() - started) * 1000:.0f} мс")
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    log(f"\n🌐 Сервис сборки: http://127.0.0.1:{port}/{output_base}.woff2?icons=vk,telegram (Ctrl+C — выход)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log("\n👋 Сервис остановлен")
+    finally:
+        server.server_close()
+
+# Синтетические наборы иконок для замеров производительности
+BENCH_VARIANTS = ('simple', 'heavy')
+
+def synthetic_svg(variant, rng):
+    """SVG иконка: простая (прямоугольник и круг) или тяжелая (многоугольник из сотен точек)"""
+    if variant == 'simple':
+        x, y, size = rng.randint(0, 200), rng.randint(0, 200), rng.randint(300, 700)
+        r = rng.randint(50, 150)
+        path = (f"M{x} {y}h{size}v{size}h-{size}z"
+                f"M{x + size // 2 - r} {y + size // 2}a{r} {r} 0 1 0 {2 * r} 0a{r} {r} 0 1 0 -{2 * r} 0z")
+    else:
+        # «Дизайнерский» экспорт: много точек на плавной кривой
+        points = []
+        count = rng.randint(300, 600)
+        for i in range(count):
+            angle = 2 * math.pi * i / count
+            radius = 350 + 80 * math.sin(angle * rng.randint(3, 9)) + rng.uniform(-2, 2)
+            points.append(f"{500 + radius * math.cos(angle):.2f} {500 + radius * math.sin(angle):.2f}")
+        path = "M" + "L".join(points) + "z"
+    return (f'<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 1000 1000"><path d="{path}"/></svg>\n')
+
+def generate_corpus(svg_dir, count, variant, seed=0):
+    """Создает набор синтетических SVG и сопоставление символов из области PUA"""
+    import random
+    rng = random.Random(f"{variant}-{count}-{seed}")
+    os.makedirs(svg_dir, exist_ok=True)
+    mapping = {}
+    for i in range(count):
+        svg_file = f"icon{i:05d}.svg"
+        with open(os.path.join(svg_dir, svg_file), 'w', encoding='utf-8') as f:
+            f.write(synthetic_svg(variant, rng))
+        mapping[chr(0xE000 + i)] = svg_file
+    return mapping
+
+def run_benchmark_case(count, variant, woff_converter, woff2_converter, jobs=1, settings=GLYPH_SETTINGS,
+                       options=None):
+    """Один замер в отдельном процессе: время этапов, пиковая память и размеры файлов"""
+    import resource
+
+    reset_worker_output()
+    apply_output_options(options)
+    with scratch_dir() as tmp:
+        svg_dir = os.path.join(tmp, 'icons')
+        output_dir = os.path.join(tmp, 'out')
+        mapping = generate_corpus(svg_dir, count, variant)
+
+        stages = {}
+        files = {}
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            font, created_glyphs = build_font(svg_dir, 'Bench', mapping, None, jobs, settings)
+            stages['glyphs'] = time.perf_counter() - started
+            ok = write_artifacts(font, 'Bench', created_glyphs, woff_converter, woff2_converter, None, output_dir,
+                                 stats=stages, files=files)
+            font.close()
+        total = time.perf_counter() - started
+
+        sizes = {}
+        for ext in ('woff', 'woff2', 'css', 'html'):
+            path = files.get(ext) or os.path.join(output_dir, f"Bench.{ext}")
+            if os.path.exists(path):
+                sizes[ext] = os.path.getsize(path)
+
+    # ru_maxrss в Linux — в килобайтах; внешние конвертеры учитываются отдельно
+    peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return {
+        'ok': ok,
+        'glyphs': len(created_glyphs),
+        'total_s': round(total, 4),
+        'stages_s': {name: round(duration, 4) for name, duration in stages.items()},
+        'peak_rss_kb': peak_rss,
+        'sizes': sizes,
+    }
+
+def benchmark_metrics(case):
+    """Числовые показатели замера в плоском виде: {имя: значение}"""
+    metrics = {'total_s': case['total_s'], 'peak_rss_kb': case['peak_rss_kb']}
+    metrics.update({f"stages_s.{name}": value for name, value in case['stages_s'].items()})
+    metrics.update({f"sizes.{ext}": value for ext, value in case['sizes'].items()})
+    return metrics
+
+def compare_benchmarks(cases, baseline_cases, threshold):
+    """Показатели, ухудшившиеся больше допустимого относительно базовых"""
+    regressions = []
+    for key, case in cases.items():
+        if key not in baseline_cases:
+            continue
+        base_metrics = benchmark_metrics(baseline_cases[key])
+        for metric, value in benchmark_metrics(case).items():
+            base = base_metrics.get(metric)
+            if not base:
+                continue
+            # Этапы короче 50 мс слишком шумные для сравнения
+            if (metric == 'total_s' or metric.startswith('stages_s.')) and base < 0.05:
+                continue
+            if value > base * (1 + threshold):
+                regressions.append((key, metric, base, value))
+    return regressions
+
+def run_benchmark(sizes, woff_converter, woff2_converter, output_file, baseline_file=None, threshold=0.2,
+                  save_baseline=False, jobs=1, settings=GLYPH_SETTINGS):
+    """Замеряет полный цикл сборки на синтетических наборах, сравнивает с базовыми значениями"""
+    from concurrent.futures import ProcessPoolExecutor
+    log(f"\n=== Замер производительности: {', '.join(map(str, sizes))} иконок ===")
+    cases = {}
+    options = output_options()
+    for count in sizes:
+        for variant in BENCH_VARIANTS:
+            key = f"{variant}-{count}"
+            # Каждый замер — в свежем процессе, чтобы пиковая память не накапливалась
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                case = pool.submit(run_benchmark_case, count, variant, woff_converter, woff2_converter,
+                                   jobs, settings, options).result()
+            cases[key] = case
+            stages = ', '.join(f"{name} {value:.2f}" for name, value in case['stages_s'].items())
+            woff2 = case['sizes'].get('woff2')
+            log(f"  {'✓' if case['ok'] else '❌'} {key:<12} {case['total_s']:>7.2f} с  "
+                  f"{case['peak_rss_kb'] / 1024:>6.0f} MB  WOFF2 {woff2 / 1024 if woff2 else 0:.1f} KB  ({stages})")
+
+    results = {'python': sys.version.split()[0], 'jobs': jobs, 'cases': cases}
+    write_atomic(output_file, json.dumps(results, indent=2))
+    log(f"✓ Результаты: {output_file}")
+
+    ok = all(case['ok'] for case in cases.values())
+    if baseline_file and save_baseline:
+        if not ok:
+            # Неудачный прогон не должен становиться эталоном
+            log(f"❌ Есть ошибки замеров — базовые значения не сохранены: {baseline_file}")
+            return False
+        write_atomic(baseline_file, json.dumps(results, indent=2))
+        log(f"✓ Базовые значения сохранены: {baseline_file}")
+        return True
+
+    if baseline_file and os.path.exists(baseline_file):
+        with open(baseline_file, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_benchmarks(cases, baseline.get('cases', {}), threshold)
+        if regressions:
+            log(f"❌ Ухудшения больше {threshold:.0%}:")
+            for key, metric, base, value in regressions:
+                log(f"  • {key} {metric}: {base} → {value}")
+            return False
+        log(f"✅ Ухудшений больше {threshold:.0%} нет")
+    return ok
+
+def parse_args(argv=None):
+    """Разбор аргументов командной строки"""
+    parser = argparse.ArgumentParser(description="ProTo Icon Font Generator")
+    parser.add_argument('svg_dir', nargs='?', default='icons',
+                        help="директория с SVG (по умолчанию icons)")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="число процессов для импорта SVG (0 — по числу ядер)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="не использовать кэш сборки")
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help="печатать только предупреждения и ошибки")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help=f"печатать каждый глиф, даже если их больше {GLYPH_LOG_LIMIT}")
+    parser.add_argument('--log-json', metavar='ФАЙЛ',
+                        help="записывать сообщения и интервалы времени в журнал JSON Lines")
+    parser.add_argument('--trace', metavar='ФАЙЛ',
+                        help="сохранить трассу этапов в формате Chrome Trace (chrome://tracing, Perfetto)")
+    parser.add_argument('--backend', choices=('auto', 'python', 'external'), default='auto',
+                        help="кодировщики WOFF/WOFF2: встроенные (python), внешние утилиты "
+                             "(external) или встроенные, если доступны (auto)")
+    parser.add_argument('-o', '--output-dir', default='.',
+                        help="каталог для готовых файлов (по умолчанию текущий)")
+    parser.add_argument('--max-compression', action='store_true',
+                        help="перебрать все кодировщики и настройки WOFF/WOFF2 и оставить самый маленький "
+                             "результат (кэшируется по хэшу TTF)")
+    parser.add_argument('--minify-css', action='store_true',
+                        help="записывать CSS без пробелов и переводов строк")
+    parser.add_argument('--split-css', action='store_true',
+                        help="разделить CSS: основной (@font-face и правила по URL) и отложенный "
+                             "с классами иконок (.icons.css)")
+    parser.add_argument('--font-display', choices=('auto', 'block', 'swap', 'fallback', 'optional'),
+                        default='block', help="значение font-display в @font-face (по умолчанию block)")
+    parser.add_argument('--hashed-names', action='store_true',
+                        help="добавлять хэш содержимого в имена файлов шрифта (ProTo.<хэш>.woff2) "
+                             "и записывать ProTo.manifest.json")
+    parser.add_argument('--inline-css', action='store_true',
+                        help="дополнительно создать CSS со встроенным WOFF2 (.inline.css, и для подмножеств)")
+    parser.add_argument('--sprite', action='store_true',
+                        help="дополнительно создать SVG-спрайт с <symbol> для каждой иконки (.sprite.svg)")
+    parser.add_argument('--serve', type=int, metavar='ПОРТ',
+                        help="запустить локальный сервис сборки шрифтов и подмножеств по HTTP")
+    parser.add_argument('--serve-cache', type=int, default=64, metavar='МБ',
+                        help="объем кэша собранных файлов сервиса в памяти (по умолчанию 64 МБ)")
+    parser.add_argument('--watch', action='store_true',
+                        help="следить за директорией с SVG и пересобирать измененные глифы")
+    parser.add_argument('--auto', action='store_true',
+                        help="взять все SVG из директории и назначить им постоянные коды PUA "
+                             f"(сохраняются в {CODEPOINTS_FILE})")
+    parser.add_argument('--codepoints', metavar='ФАЙЛ',
+                        help=f"файл с назначенными кодами (по умолчанию {CODEPOINTS_FILE} в директории с SVG)")
+    parser.add_argument('--batch', metavar='MANIFEST',
+                        help="собрать все наборы иконок из JSON-манифеста")
+    optimization = parser.add_argument_group("оптимизация контуров")
+    optimization.add_argument('--normalize-svg', action='store_true',
+                              help="перед импортом раскрыть группы и трансформации, перевести фигуры и дуги "
+                                   "в пути, убрать все, кроме залитой геометрии, и привести SVG к размеру em")
+    optimization.add_argument('--batch-ops', action='store_true',
+                              help="импортировать все SVG, а затем упрощать и округлять контуры одной операцией "
+                                   "над выделением шрифта (быстрее на тысячах мелких иконок)")
+    optimization.add_argument('--dedupe', action='store_true',
+                              help="хранить одинаковые глифы и общие части контуров (например, рамку file-*) "
+                                   "один раз как составные ссылки TrueType")
+    optimization.add_argument('--dedupe-tolerance', type=float, default=GLYPH_SETTINGS['dedupe_tolerance'],
+                              metavar='ЕДИНИЦ',
+                              help="допуск совпадения контуров при --dedupe в единицах em (0 — только точные)")
+    optimization.add_argument('--simplify-error', type=float, metavar='ЕДИНИЦ',
+                              help="допустимая погрешность упрощения контуров (больше — меньше точек)")
+    optimization.add_argument('--remove-overlap', action='store_true',
+                              help="удалять пересечения контуров")
+    optimization.add_argument('--merge-lines', action='store_true',
+                              help="объединять отрезки, лежащие на одной прямой")
+    optimization.add_argument('--remove-singletons', action='store_true',
+                              help="удалять лишние одиночные точки")
+    optimization.add_argument('--quadratic', action='store_true',
+                              help="переводить контуры в квадратичные кривые до округления")
+    optimization.add_argument('--quantize', type=int, default=1, metavar='ЕДИНИЦ',
+                              help="округлять координаты до сетки с таким шагом (по умолчанию 1)")
+    optimization.add_argument('--opt-report', action='store_true',
+                              help="печатать число точек и размер каждого глифа до и после оптимизации")
+    bench = parser.add_argument_group("замер производительности")
+    bench.add_argument('--benchmark', action='store_true',
+                       help="собрать синтетические наборы иконок и замерить этапы, память и размеры")
+    bench.add_argument('--bench-sizes', default='100,1000,10000', metavar='N,N,...',
+                       help="размеры наборов (по умолчанию 100,1000,10000)")
+    bench.add_argument('--bench-output', default='benchmark.json', metavar='ФАЙЛ',
+                       help="куда записать результаты (JSON)")
+    bench.add_argument('--bench-baseline', metavar='ФАЙЛ',
+                       help="базовые значения: при ухудшении больше порога — код возврата 1")
+    bench.add_argument('--bench-threshold', type=float, default=0.2,
+                       help="допустимое ухудшение относительно базовых значений (по умолчанию 0.2)")
+    bench.add_argument('--bench-save-baseline', action='store_true',
+                       help="сохранить результаты как базовые значения")
+    parser.add_argument('--css-only', action='store_true',
+                        help="только пересобрать CSS по манифесту глифов прошлой сборки (без fontforge)")
+    parser.add_argument('--html-only', action='store_true',
+                        help="только пересобрать HTML демо по манифесту глифов прошлой сборки (без fontforge)")
+    parser.add_argument('--glyph-sizes', action='store_true',
+                        help="показать вклад каждого глифа в сжатый размер шрифта (худшие первыми)")
+    parser.add_argument('--budget-glyph', type=int, metavar='БАЙТ',
+                        help="ошибка сборки, если вклад одного глифа в сжатый размер больше БАЙТ")
+    parser.add_argument('--budget-total', type=int, metavar='БАЙТ',
+                        help="ошибка сборки, если WOFF2 больше БАЙТ")
+    parser.add_argument('--chunks', action='store_true',
+                        help="собрать по WOFF2 на группу иконок (social, ui, arrows, files, other) "
+                             "с @font-face и unicode-range для каждой части")
+    parser.add_argument('--groups', metavar='ФАЙЛ',
+                        help="группы иконок для --chunks из JSON {группа: [имена SVG или шаблоны]}")
+    parser.add_argument('--subset', nargs='+', metavar='[ИМЯ=]ФАЙЛЫ',
+                        help="собрать WOFF2 и CSS только с глифами, используемыми на страницах "
+                             "(HTML/CSS/шаблоны; можно указывать шаблоны glob)")
+    return parser.parse_args(argv)
+
+def glyph_settings(args):
+    """Параметры обработки глифов из аргументов командной строки"""
+    return dict(
+        GLYPH_SETTINGS,
+        simplify_error=args.simplify_error,
+        remove_overlap=args.remove_overlap,
+        merge_lines=args.merge_lines,
+        remove_singletons=args.remove_singletons,
+        quadratic=args.quadratic,
+        quantize=max(1, args.quantize),
+        normalize_svg=args.normalize_svg,
+        dedupe=args.dedupe,
+        dedupe_tolerance=max(0, args.dedupe_tolerance),
+        batch_ops=args.batch_ops,
+    )
 
 def main():
-    print("🔤 ProTo Icon Font Generator")
+    args = parse_args()
+    configure_output(args.quiet, args.verbose, args.log_json, bool(args.trace))
+    try:
+        with span('build'):
+            run(args)
+    finally:
+        if args.trace:
+            write_trace(args.trace)
+        if OUTPUT['jsonl'] is not None:
+            OUTPUT['jsonl'].close()
+
+def run(args):
+    """Выполняет выбранный режим работы"""
+    log("🔤 ProTo Icon Font Generator")
     
     # Определяем директорию с SVG
-    svg_dir = "icons"
-    if len(sys.argv) > 1:
-        svg_dir = sys.argv[1]
+    svg_dir = args.svg_dir
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    cache_dir = None if args.no_cache else CACHE_DIR
+    settings = glyph_settings(args)
+    CSS_OPTIONS.update(minify=args.minify_css, split=args.split_css, font_display=args.font_display)
+    FILE_NAMING['hashed'] = args.hashed_names
+    TARGETS.update(inline_css=args.inline_css, sprite=args.sprite)
+    SIZE_BUDGET.update(report=args.glyph_sizes, glyph=args.budget_glyph, total=args.budget_total)
     
     output_base = "ProTo"
     
-    print(f"📁 Директория с SVG: {svg_dir}")
-    print(f"📦 Имя шрифта: {output_base}")
+    log(f"📁 Директория с SVG: {svg_dir}")
+    log(f"📦 Имя шрифта: {output_base}")
+    
+    if args.css_only or args.html_only:
+        # fontforge и конвертеры не нужны: глифы берутся из манифеста прошлой сборки
+        if not regenerate_from_manifest(output_base, args.output_dir, css=args.css_only, html=args.html_only):
+            sys.exit(1)
+        return
     
     # Проверяем зависимости
-    deps_ok, woff_converter, woff2_converter = check_dependencies()
+    with span('dependencies'):
+        deps_ok, woff_converter, woff2_converter = check_dependencies(args.backend, cache_dir)
     
     if not deps_ok:
-        print("\n❌ Не все зависимости установлены!")
-        print("\nУстановите необходимые пакеты:")
-        print("  sudo apt update")
-        print("  sudo apt install fontforge python3-fontforge woff2 sfnt2woff-zopfli")
-        print("\nИли создайте символические ссылки:")
-        print("  sudo ln -s /usr/bin/woff2_compress /usr/local/bin/woff2_compress")
-        print("  sudo ln -s /usr/bin/sfnt2woff-zopfli /usr/local/bin/sfnt2woff")
+        log("\n❌ Не все зависимости установлены!")
+        log("\nУстановите необходимые пакеты:")
+        log("  sudo apt update")
+        log("  sudo apt install fontforge python3-fontforge woff2 sfnt2woff-zopfli")
+        log("\nИли создайте символические ссылки:")
+        log("  sudo ln -s /usr/bin/woff2_compress /usr/local/bin/woff2_compress")
+        log("  sudo ln -s /usr/bin/sfnt2woff-zopfli /usr/local/bin/sfnt2woff")
+        return
+    
+    if args.batch:
+        if not build_batch(args.batch, woff_converter, woff2_converter, cache_dir=cache_dir, jobs=jobs,
+                           settings=settings):
+            sys.exit(1)
+        return
+    
+    if args.benchmark:
+        sizes = [int(size) for size in args.bench_sizes.split(',') if size.strip()]
+        if not run_benchmark(sizes, woff_converter, woff2_converter, args.bench_output, args.bench_baseline,
+                             args.bench_threshold, args.bench_save_baseline, jobs=jobs, settings=settings):
+            sys.exit(1)
+        return
+    
+    if args.auto:
+        mapping = allocate_codepoints(svg_dir, args.codepoints)
+        log(f"🔢 Автоматическое назначение кодов: {len(mapping)} иконок")
+    else:
+        mapping = icon_mapping
+    
+    if args.subset:
+        if not build_subsets(svg_dir, output_base, mapping, args.subset, woff2_converter,
+                             cache_dir=cache_dir, output_dir=args.output_dir, settings=settings):
+            sys.exit(1)
+        return
+    
+    if args.chunks:
+        try:
+            groups = load_groups(args.groups) if args.groups else icon_groups
+        except (OSError, ValueError) as e:
+            log(f"❌ Не удалось прочитать группы {args.groups}: {e}")
+            sys.exit(1)
+        if not build_chunks(svg_dir, output_base, mapping, groups, woff2_converter,
+                            cache_dir=cache_dir, output_dir=args.output_dir, settings=settings):
+            sys.exit(1)
+        return
+    
+    if args.serve:
+        serve(args.serve, svg_dir, output_base, mapping, woff_converter, woff2_converter, cache_dir=cache_dir,
+              settings=settings, cache_size=args.serve_cache * 1024 * 1024, minify=args.minify_css,
+              font_display=args.font_display)
+        return
+    
+    if args.watch:
+        watch_font(svg_dir, output_base, mapping, woff_converter, woff2_converter,
+                   cache_dir=cache_dir, jobs=jobs, output_dir=args.output_dir, settings=settings,
+                   auto=args.auto, codepoints_file=args.codepoints)
         return
     
     # Запускаем создание шрифта
-    create_font_with_mapping(svg_dir, output_base, icon_mapping, woff_converter, woff2_converter)
+    if not create_font_with_mapping(svg_dir, output_base, mapping, woff_converter, woff2_converter,
+                                    cache_dir=cache_dir, jobs=jobs, output_dir=args.output_dir, settings=settings,
+                                    report=args.opt_report, max_compression=args.max_compression):
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
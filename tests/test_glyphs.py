@@ -0,0 +1,112 @@
+import json
+
+import ProTo_font
+
+
+def contour(points, closed=True):
+    return {'points': [(x, y, True) for x, y in points], 'closed': closed}
+
+
+SQUARE = [(0, 0), (0, 10), (10, 10), (10, 0)]
+
+
+def shifted(points, dx, dy):
+    return [(x + dx, y + dy) for x, y in points]
+
+
+def test_contour_classes_exact_match_up_to_offset():
+    """Одинаковые контуры в разных местах попадают в один класс со своими сдвигами"""
+    outlines = {
+        'a': {'contours': [contour(SQUARE), contour([(0, 0), (5, 5), (10, 0)])]},
+        'b': {'contours': [contour(shifted(SQUARE, 100, 50))]},
+    }
+    classes = ProTo_font.contour_classes(outlines, 0)
+    assert classes['a'][0][0] == classes['b'][0][0]
+    assert classes['a'][1][0] != classes['a'][0][0]
+    assert classes['b'][0][1] == (100, 50)
+
+
+def test_contour_classes_exact_rejects_small_difference():
+    other = [(x, y) for x, y in SQUARE]
+    other[2] = (10.01, 10)
+    outlines = {'a': {'contours': [contour(SQUARE)]}, 'b': {'contours': [contour(other)]}}
+    classes = ProTo_font.contour_classes(outlines, 0)
+    assert classes['a'][0][0] != classes['b'][0][0]
+
+
+def test_contour_classes_tolerance():
+    """С допуском совпадают контуры, отличающиеся не больше чем на tolerance в каждой точке"""
+    near = [(x, y) for x, y in SQUARE]
+    near[2] = (10.4, 9.7)
+    far = [(x, y) for x, y in SQUARE]
+    far[2] = (11.0, 10)
+    outlines = {
+        'a': {'contours': [contour(SQUARE)]},
+        'b': {'contours': [contour(shifted(near, 7, 3))]},
+        'c': {'contours': [contour(far)]},
+    }
+    classes = ProTo_font.contour_classes(outlines, 0.5)
+    assert classes['a'][0][0] == classes['b'][0][0]
+    assert classes['c'][0][0] != classes['a'][0][0]
+
+
+def test_contour_classes_open_and_closed_differ():
+    outlines = {'a': {'contours': [contour(SQUARE)]}, 'b': {'contours': [contour(SQUARE, closed=False)]}}
+    for tolerance in (0, 0.5):
+        classes = ProTo_font.contour_classes(outlines, tolerance)
+        assert classes['a'][0][0] != classes['b'][0][0]
+
+
+def test_allocate_codepoints_keeps_existing_codes(tmp_path):
+    """Коды сохраняются между сборками, коды удаленных иконок не переиспользуются"""
+    for name in ('b.svg', 'a.svg'):
+        (tmp_path / name).write_text('<svg/>')
+    mapping = ProTo_font.allocate_codepoints(str(tmp_path))
+    assert mapping == {'\ue000': 'a.svg', '\ue001': 'b.svg'}
+
+    (tmp_path / 'a.svg').unlink()
+    (tmp_path / 'c.svg').write_text('<svg/>')
+    mapping = ProTo_font.allocate_codepoints(str(tmp_path))
+    assert mapping == {'\ue001': 'b.svg', '\ue002': 'c.svg'}
+    manifest = json.loads((tmp_path / ProTo_font.CODEPOINTS_FILE).read_text())
+    assert manifest['glyphs'] == {'a.svg': 'U+E000', 'b.svg': 'U+E001', 'c.svg': 'U+E002'}
+
+
+def test_next_free_codepoint_moves_to_next_plane():
+    assert ProTo_font.next_free_codepoint(0xF8FF, set()) == 0xF8FF
+    assert ProTo_font.next_free_codepoint(0xF8FF, {0xF8FF}) == 0xF0000
+
+
+def test_css_string_escapes():
+    """Символы вне ASCII экранируются; пробел отделяет escape от следующей шестнадцатеричной цифры"""
+    assert ProTo_font.css_string('A') == '"A"'
+    assert ProTo_font.css_string('\ue001') == '"\\e001"'
+    assert ProTo_font.css_string('\ue001a') == '"\\e001 a"'
+    assert ProTo_font.css_string('\ue001z') == '"\\e001z"'
+    assert ProTo_font.css_string('"\\') == '"\\"\\\\"'
+    assert ProTo_font.css_unescape(ProTo_font.css_string('\ue001a')[1:-1]) == '\ue001a'
+
+
+def test_unicode_range_merges_spans():
+    assert ProTo_font.unicode_range('\ue002\ue000\ue001\ue005A') == 'U+41, U+E000-E002, U+E005'
+
+
+def test_scan_usage(tmp_path):
+    """Ссылки, классы и символы шрифта из HTML и CSS"""
+    font_chars = {'\ue000', '\ue001', '\ue002', 'A'}
+    html = tmp_path / 'page.html'
+    html.write_text('<a href="https://vk.com/x" class="btn icon-vk">A \ue002</a>', encoding='utf-8')
+    css = tmp_path / 'page.css'
+    css.write_text('.x:before { content: "\\e001"; }', encoding='utf-8')
+    usage = ProTo_font.scan_usage([str(html), str(css)], font_chars)
+    assert usage['hrefs'] == {'https://vk.com/x'}
+    assert usage['classes'] == {'btn', 'icon-vk'}
+    assert usage['chars'] == {'\ue001', '\ue002'}
+
+
+def test_glyphs_used_by_selectors():
+    css = ('a[href*="vk.com"]:before { content: "\\e000"; }\n'
+           '.icon-tg:before { content: "\\e001"; }\n'
+           '.icon-vk:before, .unused:before { content: "\\e002"; }\n')
+    usage = {'hrefs': {'https://vk.com/x'}, 'classes': {'icon-vk'}, 'chars': set()}
+    assert ProTo_font.glyphs_used(css, usage, {'\ue000', '\ue001', '\ue002'}) == {'\ue000', '\ue002'}
@@ -0,0 +1,74 @@
+import math
+
+import pytest
+
+import ProTo_font
+
+
+def close(a, b, eps=1e-6):
+    return all(math.isclose(x, y, abs_tol=eps) for p, q in zip(a, b) for x, y in zip(p, q))
+
+
+def test_parse_path_absolute_and_relative():
+    """Относительные команды переводятся в абсолютные, H/V — в отрезки"""
+    commands = ProTo_font.parse_path("M10 20 l5 0 h5 v5 H10 Z")
+    assert [op for op, _ in commands] == ['M', 'L', 'L', 'L', 'L', 'Z']
+    assert [points for _, points in commands[:-1]] == [
+        [(10, 20)], [(15, 20)], [(20, 20)], [(20, 25)], [(10, 25)]]
+
+
+def test_parse_path_implicit_lineto_after_moveto():
+    """Пары чисел после M — отрезки, после m — относительные отрезки"""
+    assert ProTo_font.parse_path("M0 0 10 0 10 10") == [('M', [(0, 0)]), ('L', [(10, 0)]), ('L', [(10, 10)])]
+    assert ProTo_font.parse_path("m5 5 1 1") == [('M', [(5, 5)]), ('L', [(6, 6)])]
+
+
+def test_parse_path_compact_numbers():
+    """Числа без разделителей: знак и точка начинают новое число"""
+    assert ProTo_font.parse_path("M1-2L.5.5") == [('M', [(1, -2)]), ('L', [(0.5, 0.5)])]
+
+
+def test_parse_path_smooth_cubic_reflects_control():
+    """S отражает вторую управляющую точку предыдущей C"""
+    commands = ProTo_font.parse_path("M0 0 C0 10 10 10 10 0 S20 -10 20 0")
+    assert commands[2] == ('C', [(10, -10), (20, -10), (20, 0)])
+
+
+def test_parse_path_quadratic_becomes_cubic():
+    """Q переводится в кубическую кривую с управляющими точками на 2/3"""
+    (_, _), (op, points) = ProTo_font.parse_path("M0 0 Q30 30 60 0")
+    assert op == 'C'
+    assert close(points, [(20, 20), (40, 20), (60, 0)])
+
+
+def test_parse_path_draw_after_close_starts_at_subpath():
+    """Рисование после Z без M продолжается с начала закрытого контура"""
+    commands = ProTo_font.parse_path("M1 1 L5 1 Z l1 1")
+    assert commands[3:] == [('M', [(1, 1)]), ('L', [(2, 2)])]
+
+
+def test_parse_path_arc_flags_without_separators():
+    """Флаги дуги могут быть записаны слитно с координатами"""
+    assert ProTo_font.parse_path("M0 0 a5 5 0 0110 0") == ProTo_font.parse_path("M0 0 a5 5 0 0 1 10 0")
+
+
+def test_parse_path_rejects_numbers_without_command():
+    with pytest.raises(ValueError):
+        ProTo_font.parse_path("10 10")
+
+
+def test_arc_half_circle():
+    """Полуокружность — две кубические кривые, точки лежат на окружности"""
+    commands = ProTo_font.arc_commands((0, 0), (10, 0), 5, 5, 0, False, True)
+    assert [op for op, _ in commands] == ['C', 'C']
+    assert commands[-1][1][2] == (10, 0)
+    middle = commands[0][1][2]
+    assert math.isclose(math.hypot(middle[0] - 5, middle[1]), 5)
+
+
+def test_arc_radius_scaled_up_and_degenerate():
+    """Слишком малый радиус увеличивается, нулевой радиус дает отрезок"""
+    commands = ProTo_font.arc_commands((0, 0), (10, 0), 1, 1, 0, False, True)
+    assert commands[-1][1][2] == (10, 0)
+    assert ProTo_font.arc_commands((0, 0), (10, 0), 0, 5, 0, False, True) == [('L', [(10, 0)])]
+    assert ProTo_font.arc_commands((3, 3), (3, 3), 5, 5, 0, False, True) == []
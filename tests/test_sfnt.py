@@ -0,0 +1,117 @@
+import io
+import struct
+
+import pytest
+
+import ProTo_font
+
+pytest.importorskip('fontTools')
+
+
+def build_ttf(chars, created=None):
+    """Небольшой TTF с прямоугольником на каждый символ"""
+    from fontTools.fontBuilder import FontBuilder
+    from fontTools.pens.ttGlyphPen import TTGlyphPen
+
+    names = ['.notdef'] + [f"g{ord(char):x}" for char in chars]
+    builder = FontBuilder(1000, isTTF=True)
+    builder.setupGlyphOrder(names)
+    builder.setupCharacterMap({ord(char): name for char, name in zip(chars, names[1:])})
+    glyphs = {}
+    for i, name in enumerate(names):
+        pen = TTGlyphPen(None)
+        if i:
+            pen.moveTo((100, 0))
+            pen.lineTo((100, 100 * i))
+            pen.lineTo((900, 100 * i))
+            pen.lineTo((900, 0))
+            pen.closePath()
+        glyphs[name] = pen.glyph()
+    builder.setupGlyf(glyphs)
+    builder.setupHorizontalMetrics({name: (1000, 0) for name in names})
+    builder.setupHorizontalHeader(ascent=800, descent=-200)
+    builder.setupNameTable({'familyName': 'ProTo', 'styleName': 'Regular'})
+    builder.setupOS2()
+    builder.setupPost()
+    if created is not None:
+        builder.updateHead(created=created, modified=created)
+    output = io.BytesIO()
+    builder.save(output)
+    return output.getvalue()
+
+
+@pytest.fixture
+def ttf():
+    return build_ttf('AB\ue000')
+
+
+def test_encode_woff_round_trip(ttf):
+    """WOFF раскодируется в те же таблицы с теми же контрольными суммами"""
+    woff = ProTo_font.encode_woff(ttf)
+    assert woff[:4] == b'wOFF'
+    assert struct.unpack('>L', woff[8:12])[0] == len(woff)
+    assert ProTo_font.decode_woff(woff) == ProTo_font.read_sfnt_tables(ttf)
+    assert ProTo_font.verify_round_trip(ttf, woff) is True
+
+
+def test_encode_woff_smaller_than_ttf(ttf):
+    assert len(ProTo_font.encode_woff(ttf)) < len(ttf)
+
+
+def test_verify_round_trip_detects_other_font(ttf):
+    other = ProTo_font.encode_woff(build_ttf('AC'))
+    assert ProTo_font.verify_round_trip(ttf, other) is False
+
+
+def test_decode_woff_rejects_other_data(ttf):
+    with pytest.raises(ValueError):
+        ProTo_font.decode_woff(ttf)
+
+
+def test_encode_woff2_round_trip(ttf):
+    pytest.importorskip('brotli')
+    woff2 = ProTo_font.encode_woff2(ttf)
+    assert woff2[:4] == b'wOF2'
+    assert ProTo_font.verify_round_trip(ttf, woff2) is True
+
+
+def test_deterministic_ttf_ignores_build_date(monkeypatch):
+    """Шрифты, собранные в разное время, совпадают побайтно"""
+    monkeypatch.delenv('SOURCE_DATE_EPOCH', raising=False)
+    first = ProTo_font.deterministic_ttf(build_ttf('AB', created=3_000_000_000))
+    second = ProTo_font.deterministic_ttf(build_ttf('AB', created=3_500_000_000))
+    assert first == second
+    # checkSumAdjustment: контрольная сумма всего файла равна 0xB1B0AFBA
+    assert ProTo_font.sfnt_checksum(first) == 0xB1B0AFBA
+
+
+def test_deterministic_ttf_uses_source_date_epoch(monkeypatch, ttf):
+    monkeypatch.setenv('SOURCE_DATE_EPOCH', '86400')
+    head = {tag: data for tag, _, data in ProTo_font.read_sfnt_tables(ProTo_font.deterministic_ttf(ttf))[1]}[b'head']
+    assert struct.unpack_from('>qq', head, 20) == (86400 + 2082844800,) * 2
+
+
+def test_ttf_digest_ignores_head_dates():
+    assert (ProTo_font.ttf_digest(build_ttf('AB', created=3_000_000_000)) ==
+            ProTo_font.ttf_digest(build_ttf('AB', created=3_500_000_000)))
+    assert ProTo_font.ttf_digest(build_ttf('AB')) != ProTo_font.ttf_digest(build_ttf('AC'))
+
+
+def test_cmap_codepoints_formats_4_and_12():
+    """Коды из BMP (формат 4) и дополнительных плоскостей (формат 12)"""
+    ttf = build_ttf('AB\ue000\U000f0000')
+    tables = {tag: data for tag, _, data in ProTo_font.read_sfnt_tables(ttf)[1]}
+    assert ProTo_font.cmap_codepoints(tables[b'cmap']) == {1: [0x41], 2: [0x42], 3: [0xE000], 4: [0xF0000]}
+
+
+def test_glyph_records_points(ttf):
+    records = ProTo_font.glyph_records(ttf)
+    assert [codepoints for _, codepoints, _ in records] == [[], [0x41], [0x42], [0xE000]]
+    assert [ProTo_font.glyph_points(record) for _, _, record in records] == [0, 4, 4, 4]
+
+
+def test_build_timestamp(monkeypatch):
+    monkeypatch.delenv('SOURCE_DATE_EPOCH', raising=False)
+    assert ProTo_font.build_timestamp() == 0
+    monkeypatch.setenv('SOURCE_DATE_EPOCH', '1700000000')
+    assert ProTo_font.build_timestamp() == 1700000000